@@ -0,0 +1,278 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import typing
+import zipfile
+
+import numpy as np
+
+from csp import CSP
+
+
+# the problem (numbers, groups and constraints) shared by the puzzles of a grid stack, set once per worker by
+# _init_worker, and the search settings of the batch
+_worker_problem = None
+_worker_settings = None
+
+
+def load_problem(path: str) -> dict:
+    """
+    Function that reads the problem shared by a stack of grids from a JSON file with the keys "numbers", "groups" (lists
+    of [row_idx, col_idx] pairs) and "constraints" (lists of [sum_of_elements, max_count_element] pairs).
+
+    :param path: The JSON file
+    """
+
+    with open(path) as problem_file:
+        problem = json.load(problem_file)
+    return {
+        "numbers": set(problem["numbers"]),
+        "groups": [[tuple(cell) for cell in group] for group in problem["groups"]],
+        "constraints": [tuple(constraint) for constraint in problem["constraints"]],
+    }
+
+
+def iter_npz_rows(path: str, member: str = "grids") -> typing.Iterator[np.ndarray]:
+    """
+    Generator over the grids of a (possibly compressed) .npz stack without loading the stack: the member array is
+    streamed from the archive one grid at a time.
+
+    :param path: The .npz file
+    :param member: The name of the array with shape (number of puzzles, height, width)
+    """
+
+    with zipfile.ZipFile(path) as archive, archive.open(member + ".npy") as member_file:
+        version = np.lib.format.read_magic(member_file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(member_file)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(member_file)
+        else:
+            raise ValueError(f"unsupported .npy format version {version} in {path}")
+        if fortran_order or len(shape) != 3:
+            raise ValueError(f"{member} in {path} must be a C ordered stack of grids (puzzles, height, width)")
+
+        grid_bytes = shape[1] * shape[2] * dtype.itemsize
+        for puzzle_idx in range(shape[0]):
+            yield np.frombuffer(member_file.read(grid_bytes), dtype=dtype).reshape(shape[1:])
+
+
+def iter_puzzles(path: str, problem: typing.Optional[dict] = None, start: int = 0) -> typing.Iterator[typing.Any]:
+    """
+    Generator over the puzzles of path, from puzzle start on, that reads one puzzle at a time so memory does not grow
+    with the size of the dataset.
+
+    - .npy: a stack of grids (puzzles, height, width), memory-mapped. Yields the grids, which share problem.
+    - .npz: a stack of grids in the member "grids", streamed from the archive. If the archive also holds "numbers",
+      "group_cells", "group_ptr" and "constraints" (the arrays of CSP.from_arrays) these are the shared problem.
+      Yields the grids.
+    - anything else is read as JSONL: one JSON object per line with a "grid" and optionally "numbers", "groups" and
+      "constraints" (taken from problem when missing). Yields the records.
+
+    :param path: The input file
+    :param problem: The problem shared by all puzzles (see load_problem), needed for grid stacks without one
+    :param start: The number of puzzles to skip
+    """
+
+    if path.endswith(".npy"):
+        grids = np.load(path, mmap_mode="r")
+        for puzzle_idx in range(start, len(grids)):
+            yield np.array(grids[puzzle_idx])
+    elif path.endswith(".npz"):
+        rows = iter_npz_rows(path)
+        for puzzle_idx, grid in enumerate(rows):
+            if puzzle_idx >= start:
+                yield grid
+    else:
+        with open(path) as records:
+            puzzle_idx = 0
+            for line in records:
+                if not line.strip():
+                    continue
+                if puzzle_idx >= start:
+                    yield json.loads(line)
+                puzzle_idx += 1
+
+
+def npz_problem(path: str) -> typing.Optional[dict]:
+    """
+    Function that returns the shared problem stored in an .npz stack (see iter_puzzles), or None if it has none.
+
+    :param path: The .npz file
+    """
+
+    with np.load(path) as archive:
+        if not {"numbers", "group_cells", "group_ptr", "constraints"} <= set(archive.files):
+            return None
+        return {
+            "numbers": set(archive["numbers"].tolist()),
+            "group_cells": archive["group_cells"],
+            "group_ptr": archive["group_ptr"],
+            "constraints": [tuple(constraint) for constraint in archive["constraints"].tolist()],
+        }
+
+
+def _init_worker(problem: typing.Optional[dict], search_settings: dict):
+    """
+    Pool initializer that stores the shared problem and the search settings in the worker, so that a task only has to
+    carry its grid.
+    """
+
+    global _worker_problem, _worker_settings
+    _worker_problem = problem
+    _worker_settings = search_settings
+
+
+def _solve_puzzle(puzzle: typing.Any) -> typing.Tuple[typing.Optional[list], int]:
+    """
+    Task that solves one puzzle of iter_puzzles. Returns the solution as nested lists (or None) and the number of nodes
+    expanded.
+    """
+
+    if isinstance(puzzle, dict):
+        problem = dict(_worker_problem or {})
+        problem.update(puzzle)
+        grid = np.array(problem["grid"])
+        groups = [[tuple(cell) for cell in group] for group in problem["groups"]]
+        constraints = [tuple(constraint) for constraint in problem["constraints"]]
+        csp = CSP(grid, set(problem["numbers"]), groups, constraints)
+    elif "group_cells" in _worker_problem:
+        csp = CSP.from_arrays(puzzle, _worker_problem["numbers"], _worker_problem["group_cells"],
+                              _worker_problem["group_ptr"], _worker_problem["constraints"])
+    else:
+        csp = CSP(puzzle.copy(), _worker_problem["numbers"], _worker_problem["groups"], _worker_problem["constraints"])
+
+    solution = csp.start_search(**_worker_settings)
+    return None if solution is None else solution.tolist(), csp.nodes_expanded
+
+
+def read_checkpoint(checkpoint_path: str) -> typing.Tuple[int, int]:
+    """
+    Function that returns the number of puzzles done and the size of the output file at the last checkpoint, or (0, 0)
+    if there is no checkpoint.
+
+    :param checkpoint_path: The checkpoint file written by write_checkpoint
+    """
+
+    if not os.path.exists(checkpoint_path):
+        return 0, 0
+    with open(checkpoint_path) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    return checkpoint["done"], checkpoint["offset"]
+
+
+def write_checkpoint(checkpoint_path: str, done: int, offset: int):
+    """
+    Function that atomically replaces the checkpoint with the number of puzzles done and the size of the output file.
+
+    :param checkpoint_path: The checkpoint file
+    :param done: The number of puzzles whose result is in the output file
+    :param offset: The size of the output file in bytes, everything after it is dropped on resume
+    """
+
+    with open(checkpoint_path + ".tmp", "w") as checkpoint_file:
+        json.dump({"done": done, "offset": offset}, checkpoint_file)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def solve_batch(input_path: str, output_path: str, problem: typing.Optional[dict] = None,
+                workers: typing.Optional[int] = None, window: typing.Optional[int] = None, resume: bool = False,
+                limit: typing.Optional[int] = None, checkpoint_every: int = 100, **search_settings) -> int:
+    """
+    Function that solves every puzzle of input_path (see iter_puzzles) with a pool of worker processes and writes the
+    results to output_path as JSONL, one {"index", "solution", "nodes_expanded"} object per puzzle (solution is null
+    if there is none), in input order. At most window puzzles are in flight at any time, so memory stays constant
+    however large the dataset is.
+
+    Every checkpoint_every puzzles (and at the end) the output is flushed and output_path + ".checkpoint" records how
+    far it got. With resume, the output is cut back to the last checkpoint and solving continues from there; puzzles
+    whose results were written after it are solved again. If the output is gone (or shorter than the checkpoint
+    says), the batch starts over.
+
+    :param input_path: The .npy, .npz or JSONL file with the puzzles
+    :param output_path: The JSONL file to write the results to
+    :param problem: The problem shared by the puzzles (see load_problem), defaults to the one in an .npz stack
+    :param workers: The number of worker processes, defaults to the number of CPUs
+    :param window: The number of puzzles in flight, defaults to 4 per worker
+    :param resume: If True, continue from the checkpoint of output_path instead of starting over
+    :param limit: The number of puzzles to solve in this run, or None for all remaining puzzles
+    :param checkpoint_every: The number of puzzles between checkpoints
+    :param search_settings: The settings of CSP.prepare_search
+    """
+
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    checkpoint_path = output_path + ".checkpoint"
+
+    if problem is None and input_path.endswith(".npz"):
+        problem = npz_problem(input_path)
+    if problem is None and not (input_path.endswith(".npy") or input_path.endswith(".npz")):
+        problem = {}
+    if problem is None:
+        raise ValueError(f"{input_path} is a stack of grids, the problem they share has to be given")
+
+    done, offset = read_checkpoint(checkpoint_path) if resume else (0, 0)
+    # the checkpoint is only trusted if the output it describes is still there
+    if not os.path.exists(output_path) or os.path.getsize(output_path) < offset:
+        done, offset = 0, 0
+    output_file = open(output_path, "r+" if offset > 0 else "w")
+    output_file.seek(offset)
+    output_file.truncate()
+
+    solved = 0
+    pending = collections.deque()
+    puzzles = iter_puzzles(input_path, problem, start=done)
+    executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                      initargs=(problem, search_settings))
+    try:
+        submitted = 0
+        while True:
+            # keep the window full, then write the oldest result as soon as it is there
+            while len(pending) < window and (limit is None or submitted < limit):
+                puzzle = next(puzzles, None)
+                if puzzle is None:
+                    break
+                pending.append(executor.submit(_solve_puzzle, puzzle))
+                submitted += 1
+            if not pending:
+                break
+
+            solution, nodes_expanded = pending.popleft().result()
+            output_file.write(json.dumps({"index": done, "solution": solution, "nodes_expanded": nodes_expanded}) + "\n")
+            done += 1
+            solved += solution is not None
+            if done % checkpoint_every == 0:
+                output_file.flush()
+                write_checkpoint(checkpoint_path, done, output_file.tell())
+    finally:
+        executor.shutdown(cancel_futures=True)
+        output_file.flush()
+        write_checkpoint(checkpoint_path, done, output_file.tell())
+        output_file.close()
+
+    return solved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve a batch of CSP puzzles from an .npy/.npz grid stack or JSONL.")
+    parser.add_argument("input", help=".npy or .npz stack of grids, or JSONL with one puzzle per line")
+    parser.add_argument("output", help="JSONL file to write the results to, in input order")
+    parser.add_argument("--problem", help="JSON file with the numbers, groups and constraints shared by the puzzles")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--window", type=int, default=None, help="number of puzzles in flight, 4 per worker by default")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint of the output file")
+    parser.add_argument("--limit", type=int, default=None, help="number of puzzles to solve in this run")
+    parser.add_argument("--checkpoint-every", type=int, default=100)
+    parser.add_argument("--settings", default="{}", help='search settings as JSON, e.g. \'{"variable_ordering": "mrv"}\'')
+    args = parser.parse_args()
+
+    problem = load_problem(args.problem) if args.problem else None
+    solved = solve_batch(args.input, args.output, problem, args.workers, args.window, args.resume, args.limit,
+                         args.checkpoint_every, **json.loads(args.settings))
+    print(f"solved {solved} puzzles")
+
+
+if __name__ == "__main__":
+    main()
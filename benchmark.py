@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import typing
+
+import numpy as np
+
+from csp import CSP
+from csp_stats import SearchStats
+
+
+# search settings that can be benchmarked by name
+SETTINGS = {
+    "plain": {},
+    "fc": {"forward_checking": True},
+    "mrv": {"variable_ordering": "mrv"},
+    "mrv_lcv": {"variable_ordering": "mrv", "value_ordering": "lcv"},
+    "mrv_cbj": {"variable_ordering": "mrv", "backjumping": True, "nogood_limit": 1000},
+    "mrv_bounds": {"variable_ordering": "mrv", "sum_bounds": True},
+    "mrv_gac": {"variable_ordering": "mrv", "propagation": "search"},
+    "mrv_luby": {"variable_ordering": "mrv", "restarts": "luby"},
+}
+
+
+class Instance(typing.NamedTuple):
+    name: str
+    grid: np.ndarray
+    numbers: typing.Set[int]
+    groups: typing.List[typing.List[typing.Tuple[int,int]]]
+    constraints: typing.List[typing.Tuple[int,int]]
+
+
+def latin_solution(n: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Function that returns a random n x n latin square over 1..n: the cyclic square with shuffled rows, columns and
+    symbols.
+    """
+
+    square = (np.arange(n)[:, None] + np.arange(n)[None, :]) % n
+    square = square[rng.permutation(n)][:, rng.permutation(n)]
+    return rng.permutation(n)[square] + 1
+
+
+def sudoku_solution(box: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Function that returns a random solved sudoku with box x box boxes (so of size box^2): the standard pattern with
+    shuffled bands, rows within bands, stacks, columns within stacks and symbols.
+    """
+
+    n = box * box
+    rows = np.array([band * box + row for band in rng.permutation(box) for row in rng.permutation(box)])
+    cols = np.array([stack * box + col for stack in rng.permutation(box) for col in rng.permutation(box)])
+    pattern = (box * (rows[:, None] % box) + rows[:, None] // box + cols[None, :]) % n
+    return rng.permutation(n)[pattern] + 1
+
+
+def line_groups(n: int) -> typing.List[typing.List[typing.Tuple[int,int]]]:
+    """
+    Function that returns the rows followed by the columns of an n x n grid as groups.
+    """
+
+    rows = [[(row_idx, col_idx) for col_idx in range(n)] for row_idx in range(n)]
+    columns = [[(row_idx, col_idx) for row_idx in range(n)] for col_idx in range(n)]
+    return rows + columns
+
+
+def box_groups(box: int) -> typing.List[typing.List[typing.Tuple[int,int]]]:
+    """
+    Function that returns the box x box boxes of a sudoku of size box^2 as groups.
+    """
+
+    return [[(box_row * box + i, box_col * box + j) for i in range(box) for j in range(box)]
+            for box_row in range(box) for box_col in range(box)]
+
+
+def remove_clues(solution: np.ndarray, clue_fraction: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Function that keeps a random clue_fraction of the cells of solution and empties the rest.
+    """
+
+    return np.where(rng.random(solution.shape) < clue_fraction, solution, 0)
+
+
+def latin_instance(n: int, seed: int, clue_fraction: float = 0.4) -> Instance:
+    """
+    Latin square of size n: every row and column holds 1..n once.
+    """
+
+    rng = np.random.default_rng(seed)
+    groups = line_groups(n)
+    constraints = [(n * (n + 1) // 2, 1) for group in groups]
+    grid = remove_clues(latin_solution(n, rng), clue_fraction, rng)
+    return Instance(f"latin-{n}-seed{seed}", grid, set(range(1, n + 1)), groups, constraints)
+
+
+def sudoku_instance(box: int, seed: int, clue_fraction: float = 0.45) -> Instance:
+    """
+    Sudoku of size box^2: rows, columns and boxes hold 1..box^2 once.
+    """
+
+    rng = np.random.default_rng(seed)
+    n = box * box
+    groups = line_groups(n) + box_groups(box)
+    constraints = [(n * (n + 1) // 2, 1) for group in groups]
+    grid = remove_clues(sudoku_solution(box, rng), clue_fraction, rng)
+    return Instance(f"sudoku-{n}-seed{seed}", grid, set(range(1, n + 1)), groups, constraints)
+
+
+def killer_instance(box: int, seed: int, clue_fraction: float = 0.3, max_cage_size: int = 4) -> Instance:
+    """
+    Killer sudoku of size box^2: the sudoku groups plus a random partition of the grid into connected cages, whose sum
+    constraint is the sum of the cage in a hidden solution.
+    """
+
+    rng = np.random.default_rng(seed)
+    n = box * box
+    solution = sudoku_solution(box, rng)
+
+    # grow cages from random unassigned cells into random unassigned neighbours
+    cage_of = -np.ones((n, n), dtype=np.int64)
+    cages = []
+    for start in rng.permutation(n * n).tolist():
+        cell = (start // n, start % n)
+        if cage_of[cell] >= 0:
+            continue
+        cage = [cell]
+        cage_of[cell] = len(cages)
+        size = int(rng.integers(1, max_cage_size + 1))
+        while len(cage) < size:
+            row_idx, col_idx = cage[int(rng.integers(len(cage)))]
+            # a cage may not repeat a value of the hidden solution
+            neighbours = [(row_idx + d_row, col_idx + d_col) for d_row, d_col in ((0, 1), (1, 0), (0, -1), (-1, 0))
+                          if 0 <= row_idx + d_row < n and 0 <= col_idx + d_col < n
+                          and cage_of[row_idx + d_row, col_idx + d_col] < 0
+                          and solution[row_idx + d_row, col_idx + d_col] not in [solution[other] for other in cage]]
+            if not neighbours:
+                break
+            neighbour = neighbours[int(rng.integers(len(neighbours)))]
+            cage_of[neighbour] = len(cages)
+            cage.append(neighbour)
+        cages.append(cage)
+
+    groups = line_groups(n) + box_groups(box) + cages
+    constraints = [(n * (n + 1) // 2, 1) for group_idx in range(3 * n)]
+    constraints += [(int(sum(solution[cell] for cell in cage)), 1) for cage in cages]
+    grid = remove_clues(solution, clue_fraction, rng)
+    return Instance(f"killer-{n}-seed{seed}", grid, set(range(1, n + 1)), groups, constraints)
+
+
+def unsatisfiable_instance(n: int, seed: int) -> Instance:
+    """
+    Latin square of size n with only the numbers 1..n-1 (pigeonhole): there is no solution, and proving it takes
+    exponential search for solvers that only reason about one group at a time.
+    """
+
+    rng = np.random.default_rng(seed)
+    groups = line_groups(n)
+    groups = [groups[idx] for idx in rng.permutation(len(groups))]
+    constraints = [(n * (n + 1) // 2, 1) for group in groups]
+    return Instance(f"unsat-{n}-seed{seed}", np.zeros((n, n), dtype=np.int64), set(range(1, n)), groups, constraints)
+
+
+FAMILIES = {
+    "latin": latin_instance,
+    "sudoku": sudoku_instance,
+    "killer": killer_instance,
+    "unsat": unsatisfiable_instance,
+}
+
+# the sizes that are run when none are given (for sudoku and killer the size is the box size)
+DEFAULT_SIZES = {
+    "latin": [5, 8],
+    "sudoku": [2, 3],
+    "killer": [2, 3],
+    "unsat": [4, 5],
+}
+
+
+def run_instance(instance: Instance, settings_name: str, measure_memory: bool = True) -> dict:
+    """
+    Function that solves one instance with the named search settings and returns a record with the result, the setup
+    and search times, the number of nodes and nodes per second, and (if measure_memory) the peak memory of a second,
+    traced run.
+    """
+
+    settings = SETTINGS[settings_name]
+    stats = SearchStats()
+    csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+
+    start = time.perf_counter()
+    result = csp.start_search(stats=stats, **settings)
+    total_time = time.perf_counter() - start
+
+    setup_time = stats.phase_times.get("fill_cell_to_groups", 0.0) + stats.phase_times.get("setup", 0.0)
+    search_time = stats.phase_times.get("search", 0.0)
+    record = {
+        "instance": instance.name,
+        "settings": settings_name,
+        "solved": result is not None,
+        "setup_time": setup_time,
+        "search_time": search_time,
+        "total_time": total_time,
+        "nodes_expanded": csp.nodes_expanded,
+        "backtracks": stats.backtracks,
+        "nodes_per_second": csp.nodes_expanded / search_time if search_time > 0 else None,
+    }
+
+    if measure_memory:
+        tracemalloc.start()
+        CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints).start_search(**settings)
+        record["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return record
+
+
+def git_revision() -> typing.Optional[str]:
+    """
+    Function that returns the current git commit, or None outside a git checkout.
+    """
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(families: typing.List[str], sizes: typing.Optional[typing.List[int]], seeds: typing.List[int],
+                   settings_names: typing.List[str], measure_memory: bool = True) -> dict:
+    """
+    Function that runs every combination of family, size, seed and settings and returns the report: metadata about the
+    revision and machine, and one record per run.
+    """
+
+    records = []
+    for family in families:
+        for size in sizes or DEFAULT_SIZES[family]:
+            for seed in seeds:
+                instance = FAMILIES[family](size, seed)
+                for settings_name in settings_names:
+                    record = run_instance(instance, settings_name, measure_memory)
+                    record["family"] = family
+                    record["size"] = size
+                    record["seed"] = seed
+                    records.append(record)
+                    print(f"{instance.name:24s} {settings_name:8s} solved={record['solved']!s:5s} "
+                          f"setup={record['setup_time']:.4f}s search={record['search_time']:.4f}s "
+                          f"nodes={record['nodes_expanded']}")
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "records": records,
+    }
+
+
+def compare(base_path: str, new_path: str):
+    """
+    Function that prints the search time and node count of every run in new_path relative to the same run in
+    base_path, as produced by run_benchmarks.
+    """
+
+    with open(base_path) as base_file:
+        base = json.load(base_file)
+    with open(new_path) as new_file:
+        new = json.load(new_file)
+
+    key = lambda record: (record["instance"], record["settings"])
+    base_records = {key(record): record for record in base["records"]}
+    print(f"{base.get('revision')} -> {new.get('revision')}")
+    for record in new["records"]:
+        old = base_records.get(key(record))
+        if old is None:
+            continue
+        time_ratio = record["total_time"] / old["total_time"] if old["total_time"] > 0 else float("nan")
+        print(f"{record['instance']:24s} {record['settings']:8s} time x{time_ratio:.2f} "
+              f"nodes {old['nodes_expanded']} -> {record['nodes_expanded']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CSP solver on generated puzzle families.")
+    parser.add_argument("--families", nargs="+", default=list(FAMILIES), choices=list(FAMILIES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=None,
+                        help="sizes to run (box size for sudoku and killer), defaults per family")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0, 1, 2])
+    parser.add_argument("--settings", nargs="+", default=["fc", "mrv"], choices=list(SETTINGS))
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run that measures peak memory")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the JSON report")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two JSON reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run_benchmarks(args.families, args.sizes, args.seeds, args.settings, not args.no_memory)
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
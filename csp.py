@@ -29,7 +29,170 @@ class CSP:
         self.constraints = constraints
 
         self.grid = grid
-        self.cell_to_groups = {(row_idx, col_idx): [] for row_idx in range(self.height) for col_idx in range(self.width)}
+        self.cell_to_groups = None
+        self.group_cells = None
+
+        # search settings, start_search overwrites these
+        self.forward_checking = False
+        self.variable_ordering = "static"
+        self.value_ordering = "ascending"
+        self.backjumping = False
+        self.nogood_limit = 0
+        self.sum_bounds = False
+        self.exact_sums = False
+        self.decompose = False
+        self.propagation = "none"
+        self.node_limit = None
+        self.should_stop = None
+        self.stopped = False
+        self.rng = None
+        self.restarts = "none"
+        self.restart_base = None
+        self.stats = None
+        self.nodes_expanded = 0
+        self.domain_trail = []
+
+        # search state, built by prepare_search (or by search itself, see init_search_state)
+        self.group_sums = None
+        self.cell_depth = None
+        self.nogoods = {}
+        self.nogood_index = {}
+
+
+    @classmethod
+    def from_arrays(cls, grid: np.ndarray, numbers: typing.Set[int], group_cells: np.ndarray, group_ptr: np.ndarray,
+                    constraints: typing.List[typing.Tuple[int,int]]) -> "CSP":
+        """
+        Function that builds a CSP from the compact representation of the groups instead of lists of tuples, for huge
+        instances. The groups are given as flat cell indices (row_idx * width + col_idx): the cells of group i are
+        group_cells[group_ptr[i]:group_ptr[i+1]]. They are stored as int32 arrays (int64 only when needed), and the
+        working grid is a copy of grid in the smallest integer dtype that holds all numbers and clues. The list views
+        self.groups and self.cell_to_groups are only built if they are read.
+
+        :param grid: 2-d numpy array corresponding to the grid that we have to fill in. Empty squares are denoted with 0s.
+        :param numbers: The set of numbers that we are allowed to use in order to fill the grid
+        :param group_cells: 1-d integer array with the flat cell indices of all groups, one group after the other
+        :param group_ptr: 1-d integer array of length (number of groups + 1) with the offsets of the groups in group_cells
+        :param constraints: The list of (sum_of_elements, max_count_element) constraints, one for every group
+        """
+
+        values = list(numbers) + [int(grid.min()), int(grid.max())]
+        csp = cls(grid.astype(cls.value_dtype(min(values), max(values))), numbers, None, constraints)
+        csp.group_ptr = np.asarray(group_ptr).astype(csp.index_dtype(len(group_cells)))
+        csp.group_cells = np.asarray(group_cells).astype(csp.index_dtype(grid.size))
+        csp.num_groups = len(csp.group_ptr) - 1
+        return csp
+
+
+    @staticmethod
+    def value_dtype(low: int, high: int) -> type:
+        """
+        Function that returns the smallest integer dtype that holds every value from low to high.
+
+        :param low: The smallest value that has to be stored
+        :param high: The largest value that has to be stored
+        """
+
+        dtypes = [np.uint8, np.uint16, np.uint32, np.uint64] if low >= 0 else [np.int8, np.int16, np.int32, np.int64]
+        for dtype in dtypes:
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                return dtype
+        return np.int64
+
+
+    @staticmethod
+    def index_dtype(largest_index: int) -> type:
+        """
+        Function that returns np.int32 if the given index fits in it, and np.int64 otherwise.
+
+        :param largest_index: The largest index that has to be stored
+        """
+
+        return np.int32 if largest_index < np.iinfo(np.int32).max else np.int64
+
+
+    @property
+    def groups(self) -> typing.List[typing.List[typing.Tuple[int,int]]]:
+        """
+        The groups as lists of (row_idx, col_idx) tuples. For a CSP built with from_arrays this view is built from
+        self.group_cells the first time it is read.
+        """
+
+        if self._groups is None:
+            group_ptr = self.group_ptr.tolist()
+            rows, cols = np.divmod(self.group_cells, self.width)
+            cells = list(zip(rows.tolist(), cols.tolist()))
+            self._groups = [cells[group_ptr[group_idx]:group_ptr[group_idx + 1]] for group_idx in range(self.num_groups)]
+        return self._groups
+
+
+    @groups.setter
+    def groups(self, groups: typing.Optional[typing.List[typing.List[typing.Tuple[int,int]]]]):
+        self._groups = groups
+        self.num_groups = 0 if groups is None else len(groups)
+        self.group_cells = None
+        self.cell_group_ptr = None
+
+
+    @property
+    def cell_to_groups(self) -> typing.Dict[typing.Tuple[int,int], typing.List[int]]:
+        """
+        The dict that maps every cell location (row_idx, col_idx) to the list of groups of which it is a member (see
+        fill_cell_to_groups). It is built from the compiled cell -> group incidence the first time it is read; before
+        fill_cell_to_groups every list is empty.
+        """
+
+        if self._cell_to_groups is None:
+            self._cell_to_groups = {(row_idx, col_idx): [] for row_idx in range(self.height) for col_idx in range(self.width)}
+            if self.group_cells is not None:
+                # only the cells that are in some group need a non-empty list
+                cell_group_idx = self.cell_group_idx.tolist()
+                cell_group_ptr = self.cell_group_ptr.tolist()
+                for flat_idx in np.flatnonzero(np.diff(self.cell_group_ptr)).tolist():
+                    cell = (flat_idx // self.width, flat_idx % self.width)
+                    self._cell_to_groups[cell] = cell_group_idx[cell_group_ptr[flat_idx]:cell_group_ptr[flat_idx + 1]]
+        return self._cell_to_groups
+
+
+    @cell_to_groups.setter
+    def cell_to_groups(self, cell_to_groups: typing.Optional[typing.Dict[typing.Tuple[int,int], typing.List[int]]]):
+        self._cell_to_groups = cell_to_groups
+
+
+    def groups_of_cell(self, cell: typing.Tuple[int,int]) -> typing.List[int]:
+        """
+        Function that returns the sorted list of groups of which the given cell is a member, read from the compiled
+        cell -> group incidence (without building self.cell_to_groups). Requires fill_cell_to_groups to have been called.
+
+        :param cell: The location (row_idx, col_idx) of the cell
+        """
+
+        return self.groups_of_flat(cell[0] * self.width + cell[1])
+
+
+    def groups_of_flat(self, flat_idx: int) -> typing.List[int]:
+        """
+        Version of groups_of_cell for a cell given by its flat index row_idx * self.width + col_idx, which is how the
+        search identifies cells.
+
+        :param flat_idx: The flat index of the cell
+        """
+
+        return self.cell_group_idx[self.cell_group_ptr[flat_idx]:self.cell_group_ptr[flat_idx + 1]].tolist()
+
+
+    def flat_locations(self, locations: typing.Union[np.ndarray, typing.List[typing.Tuple[int, int]]]) -> np.ndarray:
+        """
+        Function that returns the given locations as an array of flat indices row_idx * self.width + col_idx (an int32
+        array unless the grid needs int64). An array is taken to hold flat indices already and is returned as it is.
+
+        :param locations: A list of (row_idx, col_idx) tuples, or an array of flat indices
+        """
+
+        if isinstance(locations, np.ndarray):
+            return locations
+        rows_cols = np.array(locations, dtype=np.int64).reshape(-1, 2)
+        return (rows_cols[:, 0] * self.width + rows_cols[:, 1]).astype(self.index_dtype(self.grid.size))
 
 
     def fill_cell_to_groups(self):
@@ -42,13 +205,71 @@ class CSP:
 
         Before completing this function, make sure to read the assignment description and study the data structures created
         in the __init__ function above (self.groups and self.cell_to_groups).
+
+        The lists are read off the cell -> group incidence built by compile_groups, so the cost is linear in the total
+        size of the groups instead of (cells x groups x group size). The dict itself is only built when
+        self.cell_to_groups is read (the search uses the compiled incidence), which saves a lot of memory on huge grids.
         """
-        # loop through groups and add to cell_to_groups
-        for i in range(self.height):
-            for j in range(self.width):
-                for a in range(len(self.groups)):
-                    if self.groups[a].__contains__((i,j)):
-                        self.cell_to_groups[(i,j)].append(a)
+
+        self.compile_groups()
+        self.cell_to_groups = None
+        # the incremental search state belongs to the groups and grid of before, search rebuilds it
+        self.group_sums = None
+
+
+    def compile_groups(self):
+        """
+        Function that builds the precompiled (array based) representation of the groups in one pass over self.groups
+        (for a CSP built with from_arrays, self.group_cells and self.group_ptr are given). Cells are identified by their
+        flat index row_idx * self.width + col_idx, and the index arrays are int32 unless they need int64.
+
+        - self.group_cells, self.group_ptr: the flat cell indices of group i are
+          self.group_cells[self.group_ptr[i]:self.group_ptr[i+1]], in the order of self.groups[i].
+        - self.cell_group_idx, self.cell_group_ptr: the sorted groups of cell c are
+          self.cell_group_idx[self.cell_group_ptr[c]:self.cell_group_ptr[c+1]] (CSR incidence matrix).
+        - self.repeated_cells: maps (c, group) to the number of times group lists cell c, for the cells that a group
+          lists more than once (the constraints count such a cell that many times). Usually empty.
+        - self.sum_constraints, self.count_constraints: the constraints as arrays. A constraint that is None (no
+          constraint) becomes the largest int64, which is never exceeded.
+        """
+
+        if self._groups is not None:
+            group_sizes = np.array([len(group) for group in self._groups], dtype=np.int64)
+            cells = np.array([cell for group in self._groups for cell in group], dtype=np.int64).reshape(-1, 2)
+            self.group_ptr = np.zeros(self.num_groups + 1, dtype=self.index_dtype(len(cells)))
+            np.cumsum(group_sizes, out=self.group_ptr[1:])
+            self.group_cells = (cells[:, 0] * self.width + cells[:, 1]).astype(self.index_dtype(self.grid.size))
+
+        # sort the (cell, group) pairs by cell with a stable sort (the groups of a cell stay sorted), a cell that is
+        # listed twice in a group gets one entry. Everything stays in the int32 index dtype where it can.
+        num_groups = max(self.num_groups, 1)
+        group_of_entry = np.repeat(np.arange(self.num_groups, dtype=self.index_dtype(num_groups)),
+                                   np.diff(self.group_ptr))
+        order = np.argsort(self.group_cells, kind="stable")
+        entry_cells = self.group_cells[order]
+        entry_groups = group_of_entry[order]
+        del order, group_of_entry
+        first = np.ones(len(entry_cells), dtype=bool)
+        first[1:] = (entry_cells[1:] != entry_cells[:-1]) | (entry_groups[1:] != entry_groups[:-1])
+        self.repeated_cells = {}
+        if not first.all():
+            starts = np.flatnonzero(first)
+            multiplicity = np.diff(starts, append=len(entry_cells))
+            for idx in np.flatnonzero(multiplicity > 1).tolist():
+                cell_and_group = (int(entry_cells[starts[idx]]), int(entry_groups[starts[idx]]))
+                self.repeated_cells[cell_and_group] = int(multiplicity[idx])
+            del starts, multiplicity
+            entry_cells = entry_cells[first]
+            entry_groups = entry_groups[first]
+        self.cell_group_idx = entry_groups
+        self.cell_group_ptr = np.zeros(self.grid.size + 1, dtype=self.index_dtype(len(self.cell_group_idx)))
+        np.cumsum(np.bincount(entry_cells, minlength=self.grid.size), out=self.cell_group_ptr[1:])
+
+        no_constraint = np.iinfo(np.int64).max
+        self.sum_constraints = np.array([no_constraint if constraint[0] is None else constraint[0]
+                                         for constraint in self.constraints], dtype=np.int64)
+        self.count_constraints = np.array([no_constraint if constraint[1] is None else constraint[1]
+                                           for constraint in self.constraints], dtype=np.int64)
 
 
     def satisfies_sum_constraint(self, group: typing.List[typing.Tuple[int,int]], sum_constraint: int) -> bool:
@@ -65,9 +286,9 @@ class CSP:
         #variable to hold sum of group
         sum = 0
 
-        #loop through group and add to sum
+        #loop through group and add to sum (as Python ints, a small-dtype grid from from_arrays would wrap around)
         for i in range(len(group)):
-            sum += self.grid[group[i]]
+            sum += int(self.grid[group[i]])
 
         # return true if sum is less than or equal to sum_constraint, false if not
         if sum <= sum_constraint:
@@ -133,91 +354,1392 @@ class CSP:
                 
 
 
-    def search(self, empty_locations: typing.List[typing.Tuple[int, int]]) -> np.ndarray:
+    def check_grids(self, grids: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Function that checks the sum and count constraints of every group for a whole stack of grids at once, with the
+        same rules as satisfies_sum_constraint and satisfies_count_constraint. Instead of looping over the groups it
+        gathers the values of all groups through the precompiled flat cell indices (see compile_groups), and computes
+        the sums and counts with array operations. Returns two boolean arrays of shape (N, number of groups): whether
+        every grid satisfies the sum constraint of every group, and whether it satisfies the count constraint.
+
+        :param grids: 3-d numpy array of shape (N, height, width) with the grids to check (0s are empty squares)
+        """
+
+        grids = np.asarray(grids)
+        if grids.ndim != 3 or grids.shape[1:] != (self.height, self.width):
+            raise ValueError(f"expected grids of shape (N, {self.height}, {self.width}), got {grids.shape}")
+        # a CSP from from_arrays has group_cells but has not been compiled yet
+        if self.cell_group_ptr is None:
+            self.compile_groups()
+
+        num_grids = grids.shape[0]
+        num_groups = self.num_groups
+        values = grids.reshape(num_grids, -1)[:, self.group_cells].astype(np.int64)
+
+        # sums: differences of the running sum at the group boundaries
+        running_sum = np.zeros((num_grids, values.shape[1] + 1), dtype=np.int64)
+        np.cumsum(values, axis=1, out=running_sum[:, 1:])
+        sums = running_sum[:, self.group_ptr[1:]] - running_sum[:, self.group_ptr[:-1]]
+        sum_ok = sums <= self.sum_constraints
+
+        # counts: count every (grid, group, value) key, then take the largest count per (grid, group)
+        distinct_values, codes = np.unique(values.reshape(-1), return_inverse=True)
+        group_of_entry = np.repeat(np.arange(num_groups, dtype=np.int64), np.diff(self.group_ptr))
+        grid_group = np.arange(num_grids, dtype=np.int64)[:, None] * num_groups + group_of_entry
+        keys = (grid_group.reshape(-1) * len(distinct_values) + codes.reshape(-1))[values.reshape(-1) != 0]
+        distinct_keys, counts = np.unique(keys, return_counts=True)
+        key_grid_group = distinct_keys // max(len(distinct_values), 1)
+        max_counts = np.zeros(num_grids * num_groups, dtype=np.int64)
+        if len(key_grid_group) > 0:
+            # the keys are sorted, so the keys of one (grid, group) form a run
+            run_starts = np.flatnonzero(np.r_[True, key_grid_group[1:] != key_grid_group[:-1]])
+            max_counts[key_grid_group[run_starts]] = np.maximum.reduceat(counts, run_starts)
+        count_ok = max_counts.reshape(num_grids, num_groups) <= self.count_constraints
+
+        return sum_ok, count_ok
+
+
+    def init_group_state(self):
+        """
+        Function that builds the incremental constraint state from the current grid. For every group it keeps the running
+        sum of its cells (self.group_sums), the number of times every non-zero value occurs in it (self.group_counts),
+        the number of values that occur more often than the count constraint allows (self.group_overfull) and the
+        number of its cells that are still empty (self.group_empty). Once built,
+        every change to the grid must go through set_cell so that the state stays in sync with self.grid. Requires
+        fill_cell_to_groups to have been called.
+
+        self.flat_grid is a flat view of self.grid, through which the search reads and writes cells by flat index (a
+        grid that is not C-contiguous is copied into one that is first).
+        """
+
+        if not self.grid.flags.c_contiguous:
+            self.grid = np.ascontiguousarray(self.grid)
+        self.flat_grid = self.grid.reshape(-1)
+
+        self.group_sums = []
+        self.group_counts = []
+        self.group_overfull = []
+        self.group_empty = []
+
+        cell_values = self.grid.reshape(-1)[self.group_cells].tolist()
+        group_ptr = self.group_ptr.tolist()
+
+        for group_idx in range(self.num_groups):
+            count_constraint = self.constraints[group_idx][1]
+            total = 0
+            counts = {}
+            empty = 0
+            for value in cell_values[group_ptr[group_idx]:group_ptr[group_idx + 1]]:
+                total += value
+                if value != 0:
+                    counts[value] = counts.get(value, 0) + 1
+                else:
+                    empty += 1
+
+            self.group_sums.append(total)
+            self.group_counts.append(counts)
+            self.group_overfull.append(sum(1 for count in counts.values() if count > count_constraint))
+            self.group_empty.append(empty)
+
+
+    def set_cell(self, cell: typing.Tuple[int,int], value: int):
+        """
+        Function that writes value into the given cell and updates the sums and counts of every group containing the
+        cell in O(1) per group. A value of 0 empties the cell again. A cell that a group lists more than once (see
+        self.repeated_cells) counts that many times, like in satisfies_sum_constraint and satisfies_count_constraint.
+
+        :param cell: The location (row_idx, col_idx) of the cell
+        :param value: The new value of the cell (0 for empty)
+        """
+
+        self.set_flat(cell[0] * self.width + cell[1], value)
+
+
+    def set_flat(self, flat_idx: int, value: int):
+        """
+        Version of set_cell for a cell given by its flat index, which is how the search identifies cells.
+
+        :param flat_idx: The flat index row_idx * self.width + col_idx of the cell
+        :param value: The new value of the cell (0 for empty)
+        """
+
+        old_value = int(self.flat_grid[flat_idx])
+        if old_value == value:
+            return
+
+        self.flat_grid[flat_idx] = value
+
+        for group_idx in self.groups_of_flat(flat_idx):
+            times = self.repeated_cells.get((flat_idx, group_idx), 1) if self.repeated_cells else 1
+            count_constraint = self.constraints[group_idx][1]
+            counts = self.group_counts[group_idx]
+            self.group_sums[group_idx] += times * (value - old_value)
+            self.group_empty[group_idx] += times * ((value == 0) - (old_value == 0))
+
+            # remove the old value from the counts, it no longer overflows once it is back at the constraint
+            if old_value != 0:
+                counts[old_value] -= times
+                if counts[old_value] <= count_constraint < counts[old_value] + times:
+                    self.group_overfull[group_idx] -= 1
+
+            # add the new value, it starts to overflow once it goes past the constraint
+            if value != 0:
+                counts[value] = counts.get(value, 0) + times
+                if counts[value] - times <= count_constraint < counts[value]:
+                    self.group_overfull[group_idx] += 1
+
+
+    def satisfies_group_state(self, group_indices: typing.List[int]) -> bool:
+        """
+        Constant time (per group) version of satisfies_group_constraints that answers from the incremental state built
+        by init_group_state instead of rescanning the cells. Gives exactly the same result as satisfies_group_constraints
+        for the current grid.
+
+        :param group_indices: The indices of the groups for which we check all of the constraints
+        """
+
+        for group_idx in group_indices:
+            if self.group_sums[group_idx] > self.constraints[group_idx][0]:
+                return False
+            if self.group_overfull[group_idx] != 0:
+                return False
+
+        return True
+
+
+    def sum_broken(self, group_idx: int) -> bool:
+        """
+        Function that checks whether the sum of the given group is over its sum constraint in a way that the search can
+        no longer repair. When all numbers are non-negative (self.prune_sums) a sum can only grow, so this is as soon as
+        it is over the constraint. Otherwise a later cell may bring it back down, so only once the group has no empty
+        cells left. Requires init_group_state and init_values to have been called.
+
+        :param group_idx: The index of the group
+        """
+
+        return (self.group_sums[group_idx] > self.constraints[group_idx][0]
+                and (self.prune_sums or self.group_empty[group_idx] == 0))
+
+
+    def satisfies_partial_state(self, group_indices: typing.List[int]) -> bool:
+        """
+        Version of satisfies_group_state for the search, where the empty cells of the groups are still to be filled
+        in: a count that is over the count constraint always rules the grid out, a sum only if sum_broken says so.
+        For a grid without empty cells it gives the same result as satisfies_group_state.
+
+        :param group_indices: The indices of the groups for which we check all of the constraints
+        """
+
+        for group_idx in group_indices:
+            if self.group_overfull[group_idx] != 0:
+                return False
+            if self.sum_broken(group_idx):
+                return False
+
+        return True
+
+
+    def search(self, empty_locations: typing.Union[np.ndarray, typing.List[typing.Tuple[int, int]]]) -> np.ndarray:
+        """
+        Search function that returns the first solution of search_solutions. It can be called right after
+        fill_cell_to_groups: the state that the search needs (see init_search_state) is built if it is missing.
+        start_search builds it with prepare_search instead.
+
+        Returns None if there is no solution. Returns the filled in solution (self.grid) otherwise if a solution is found.
+
+        :param empty_locations: list of empty locations that still need a value from self.numbers, or the array of
+                                their flat indices (see flat_locations)
+        """
+
+        empty_locations = self.flat_locations(empty_locations)
+        if self.group_sums is None and not self.init_search_state(empty_locations):
+            return None
+        if self.restarts != "none":
+            return self.search_restarts(empty_locations)
+        return next(self.search_solutions(empty_locations), None)
+
+
+    def init_search_state(self, empty_locations: np.ndarray) -> bool:
+        """
+        Function that builds the state of search_solutions that prepare_search would build, with the search settings
+        as they are (the defaults of __init__ unless prepare_search was called): the incremental group state, the
+        values, the empty locations of every group and (when forward checking) the domains. Returns False if some
+        domain is empty, in which case there is no solution.
+
+        :param empty_locations: the flat indices of the empty locations that still need a value from self.numbers
+        """
+
+        if self.cell_group_ptr is None:
+            self.compile_groups()
+        self.init_group_state()
+        self.init_values()
+        self.cell_depth = np.zeros(self.grid.size, dtype=self.index_dtype(self.grid.size))
+        self.init_group_empty_cells(empty_locations)
+
+        return not self.forward_checking or self.init_domains(empty_locations)
+
+
+    def search_restarts(self, empty_locations: np.ndarray) -> typing.Optional[np.ndarray]:
+        """
+        Version of search that restarts the (randomized, see prepare_search) search from scratch every time it has
+        tried a number of values given by self.restarts: "luby" allows self.restart_base times the Luby sequence
+        1, 1, 2, 1, 1, 2, 4, 1, ... values per run, "geometric" allows self.restart_base * 1.5^(run - 1). Every run
+        takes other random choices, so a bad early choice costs one short run instead of the whole search. The limits
+        keep growing, so a problem without solution is still proven to have none. self.nodes_expanded counts all runs,
+        and self.node_limit and self.should_stop still bound the search as a whole.
+
+        :param empty_locations: the flat indices of the empty locations that still need a value from self.numbers
+        """
+
+        node_limit = self.node_limit
+        restart_base = self.restart_base or 4 * max(len(empty_locations), 1)
+        solution = None
+        run = 0
+        while True:
+            run += 1
+            if self.restarts == "luby":
+                run_limit = restart_base * self.luby(run)
+            else:
+                run_limit = int(restart_base * 1.5 ** (run - 1))
+            self.node_limit = self.nodes_expanded + run_limit
+            if node_limit is not None:
+                self.node_limit = min(self.node_limit, node_limit)
+            if run > 1 and self.variable_ordering != "mrv":
+                self.shuffle_locations(empty_locations)
+
+            self.stopped = False
+            solution = next(self.search_solutions(empty_locations), None)
+            # a solution, or a complete run (so no solution)
+            if solution is not None or not self.stopped:
+                break
+            # stopped before the limit of the run (by self.should_stop) or at the overall node limit
+            if self.nodes_expanded < self.node_limit or self.node_limit == node_limit:
+                break
+
+        self.node_limit = node_limit
+        return solution
+
+
+    @staticmethod
+    def luby(index: int) -> int:
+        """
+        Function that returns element index (counting from 1) of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, ...
+
+        :param index: The position in the sequence, at least 1
+        """
+
+        while True:
+            # the sequence up to 2^k - 1 is twice the sequence up to 2^(k-1) - 1 followed by 2^(k-1)
+            k = 1
+            while (1 << k) - 1 < index:
+                k += 1
+            if (1 << k) - 1 == index:
+                return 1 << (k - 1)
+            index -= (1 << (k - 1)) - 1
+
+
+    def shuffle_locations(self, empty_locations: np.ndarray):
+        """
+        Function that puts the empty locations in a random order (with self.rng), keeping the cells that are in the
+        most groups first for variable ordering "degree".
+
+        :param empty_locations: the flat indices of the empty locations that still need a value from self.numbers
+        """
+
+        empty_locations[:] = empty_locations[self.rng.permutation(len(empty_locations))]
+        if self.variable_ordering == "degree":
+            self.sort_by_degree(empty_locations)
+
+
+    def sort_by_degree(self, empty_locations: np.ndarray):
+        """
+        Function that stably sorts the empty locations (in place) so that the cells that are in the most groups come
+        first.
+
+        :param empty_locations: the flat indices of the empty locations
+        """
+
+        degrees = self.cell_group_ptr[empty_locations + 1] - self.cell_group_ptr[empty_locations]
+        empty_locations[:] = empty_locations[np.argsort(-degrees.astype(np.int64), kind="stable")]
+
+
+    def search_solutions(self, empty_locations: typing.Union[np.ndarray, typing.List[typing.Tuple[int, int]]]) -> typing.Iterator[np.ndarray]:
         """
-        Recursive exhaustive search function. It tries to fill in the empty_locations with permissible values
+        Exhaustive backtracking search function. It tries to fill in the empty_locations with permissible values
         in an attempt to find a valid solution that does not violate any of the constraints. Instead of checking all
         possible constraints after filling in a number, it checks only the relevant group constraints using the 
-        self.cell_to_groups data structure. 
+        compiled cell -> group incidence and the incremental group state (see satisfies_partial_state: with negative
+        numbers a sum over the constraint is only a failure once the group is full). With self.forward_checking set,
+        only the values left in the domain of a cell are tried and the domains are pruned after every assignment (see
+        forward_check); the order of the cells and values follows self.variable_ordering and self.value_ordering.
 
-        Returns None if there is no solution. Returns the filled in solution (self.grid) otherwise if a solution is found.
+        With self.backjumping set, every failure records the depths of the assigned cells that caused it: for a broken
+        group the cells in that group (found through self.group_empty_cells), for an empty domain the cells whose
+        assignments pruned it (self.pruned_by). When the values of a cell run out, the search jumps straight back to
+        the deepest of these cells instead of the previous one (conflict-directed backjumping), and with
+        self.nogood_limit > 0 the responsible assignments are remembered as a nogood (see add_nogood) so that the same
+        combination is rejected immediately when it comes up again.
+
+        The search is iterative rather than recursive. empty_locations itself is the order of the cells (the mrv
+        heuristic permutes it in place), the values that are left to try at every depth are kept in an array that is
+        allocated once, and domain changes are undone from self.domain_trail. Cells are identified by their flat index
+        and all per cell state (domains, depths) lives in arrays, so nothing is copied per step, the memory per empty
+        cell is a few array entries instead of Python objects, and the number of empty locations is not limited by
+        Python's recursion limit.
 
-        :param empty_locations: list of empty locations that still need a value from self.numbers 
+        This is a generator: every time all empty locations are filled in, it yields self.grid (which is overwritten
+        when the search continues) and then goes on with the next value of the last cell. When it is exhausted all
+        empty locations are 0 again. Requires init_group_state, init_values and init_group_empty_cells (and
+        init_domains when forward checking) to have been called, see prepare_search.
+
+        :param empty_locations: the flat indices of the empty locations that still need a value from self.numbers (a
+                                list of (row_idx, col_idx) tuples is converted, see flat_locations)
         """
 
-        # Stopping condition for recursion: if there are no more empty locations, return the grid
-        if len(empty_locations) == 0:
-                    return self.grid
-        
-        # variable to check if last cell is reached
-        final_Cell = False
+        empty_locations = self.flat_locations(empty_locations)
+        num_empty = len(empty_locations)
+        forward_checking = self.forward_checking
+        backjumping = self.backjumping
+        stats = self.stats
+        mrv = self.variable_ordering == "mrv"
+        # lcv and random value orders try the values from a list, the ascending order from the domain bitset
+        lcv = self.value_ordering == "lcv" or self.rng is not None
+        propagate = self.propagation == "search"
+        node_limit = self.node_limit
+        should_stop = self.should_stop
+        budgeted = node_limit is not None or should_stop is not None
+        found_solution = False
+        cell_depth = self.cell_depth
 
-        #first_cell and second_cell are the first two cells in empty_locations
-        first_cell = empty_locations[0]
+        # per depth: the bitset of values left to try (or the lcv ordered values and the position in them), and
+        # the length of the domain trail when the cell at that depth was reached
+        values_to_try = np.zeros(num_empty, dtype=self.domain_dtype)
+        ordered_values = [None] * num_empty if lcv else None
+        positions = np.zeros(num_empty, dtype=np.int64) if lcv else None
+        trail_lengths = np.zeros(num_empty, dtype=np.int64)
 
-        # if there is more than one empty location, set second_cell to the second empty location
-        if len(empty_locations) > 1:
-            second_cell = empty_locations[1]
+        # per depth: the bitset of the depths of the cells that caused a value of the cell at that depth to fail
+        conflicts = [0] * num_empty if backjumping else None
 
-        # if no more empty locations, set FinalCell to True
-        else:
-            final_Cell = True
+        if stats is not None:
+            stats.start_phase("search")
 
-                
+        depth = 0
+        entered = True
+        while True:
+            # a new depth is reached: pick its cell and the values to try
+            if entered:
+                entered = False
+                if depth == num_empty:
+                    if stats is not None:
+                        stats.end_phase("search")
+                    yield self.grid
+                    if stats is not None:
+                        stats.start_phase("search")
+                    found_solution = True
+                    # carry on with the next value of the last cell, every earlier cell is now part of the reason
+                    # to go back so the search becomes chronological again
+                    depth -= 1
+                    if depth < 0:
+                        if stats is not None:
+                            stats.end_phase("search")
+                        return
+                    if backjumping:
+                        conflicts[depth] |= (1 << depth) - 1
+                else:
+                    if mrv:
+                        self.select_next_cell(empty_locations, depth)
+                    cell = int(empty_locations[depth])
+                    cell_depth[cell] = depth
+                    if backjumping:
+                        conflicts[depth] = 0
+                    if lcv:
+                        ordered_values[depth] = self.ordered_values(cell)
+                        positions[depth] = 0
+                    else:
+                        values_to_try[depth] = self.domains[cell] if forward_checking else self.full_domain
+                    trail_lengths[depth] = len(self.domain_trail)
 
-        #loop to start filling in the empty locations
-        while empty_locations != []:
-            
-            # +1 to the first empty location for every iteration
-            self.grid[first_cell] += 1
+            cell = int(empty_locations[depth])
+            if forward_checking:
+                self.undo_domains(int(trail_lengths[depth]))
 
-            # max_number to not exceed the biggest of self.numbers
-            max_number = max(self.numbers)
+            # take the next value, the lowest set bit is the smallest value that is left
+            if lcv:
+                position = int(positions[depth])
+                if position == len(ordered_values[depth]):
+                    value = None
+                else:
+                    value = ordered_values[depth][position]
+                    positions[depth] = position + 1
+            else:
+                remaining = int(values_to_try[depth])
+                if remaining == 0:
+                    value = None
+                else:
+                    lowest_bit = remaining & -remaining
+                    values_to_try[depth] = remaining ^ lowest_bit
+                    value = self.values[lowest_bit.bit_length() - 1]
 
-            # if maxnumber is reached, no solution is found, so return None
-            if self.grid[empty_locations[0]] > max_number:
-                return None
+            # no values left: go back to the previous depth, or with backjumping to the deepest cell that caused a
+            # failure at this depth, emptying the cells on the way
+            if value is None:
+                if backjumping:
+                    culprits = conflicts[depth]
+                    if forward_checking:
+                        culprits |= self.pruned_by.get(cell, 0)
+                    culprits &= ~(1 << depth)
+                    target_depth = culprits.bit_length() - 1
+                    if target_depth >= 0:
+                        conflicts[target_depth] |= culprits & ~(1 << target_depth)
+                    if self.nogood_limit > 0 and not found_solution:
+                        culprit_cells = [int(empty_locations[culprit_depth]) for culprit_depth in range(target_depth + 1)
+                                         if culprits >> culprit_depth & 1]
+                        self.add_nogood([(culprit, int(self.flat_grid[culprit])) for culprit in culprit_cells])
+                else:
+                    target_depth = depth - 1
 
-            # if the first empty location satisfies the group constraints, check the second empty location
-            if self.satisfies_group_constraints(self.cell_to_groups[empty_locations[0]]) == True:
+                if stats is not None:
+                    stats.record_backtrack(divmod(cell, self.width), depth, target_depth)
 
-                # if FinalCell is True, no need to check the second empty location
-                if final_Cell == True:
-                    return self.search(empty_locations[1:])
+                while depth > target_depth:
+                    self.set_flat(int(empty_locations[depth]), 0)
+                    depth -= 1
+                if depth < 0:
+                    if stats is not None:
+                        stats.end_phase("search")
+                    return
+                continue
+
+            # out of budget: empty the cells and stop, the caller can tell this apart from exhaustion by self.stopped
+            if budgeted and ((node_limit is not None and self.nodes_expanded >= node_limit) or
+                             (should_stop is not None and self.nodes_expanded % 256 == 0 and should_stop())):
+                self.stopped = True
+                for stop_depth in range(depth + 1):
+                    self.set_flat(int(empty_locations[stop_depth]), 0)
+                if forward_checking:
+                    self.undo_domains(int(trail_lengths[0]))
+                if stats is not None:
+                    stats.end_phase("search")
+                return
+
+            self.set_flat(cell, value)
+            self.nodes_expanded += 1
+            if stats is not None:
+                stats.record_assign(self, divmod(cell, self.width), value, depth)
 
-                #try to fill in the next empty location
-                for i in range(len(self.numbers)):
-                    self.grid[second_cell] += 1
-                    if self.satisfies_group_constraints(self.cell_to_groups[second_cell]) == True:
-                        
-                        # As we check location by location, make second_cell zero before the recursive call
-                        self.grid[second_cell] = 0 
-                        
-                        # if the second empty location satisfies the group constraints, recursively call the function to check the next empty location
-                        return self.search(empty_locations[1:])
+            if self.nogood_limit > 0 and self.nogood_index:
+                nogood_culprits = self.matching_nogood(cell, value)
+                if nogood_culprits is not None:
+                    conflicts[depth] |= nogood_culprits
+                    continue
 
-                # if no number satisfies the constraints, second_cell is set to 0 and first_cell is incremented by 1
-                self.grid[second_cell] = 0
+            groups = self.groups_of_flat(cell)
+            if not self.satisfies_partial_state(groups):
+                if backjumping:
+                    conflicts[depth] |= self.conflict_depths(cell, value)
+                continue
+
+            if self.sum_bounds:
+                broken_group = next((group_idx for group_idx in groups if not self.satisfies_sum_bounds(group_idx)), None)
+                if broken_group is not None:
+                    if backjumping:
+                        conflicts[depth] |= self.filled_depths(broken_group) & ~(1 << depth)
+                    continue
 
-            elif self.satisfies_group_constraints(self.cell_to_groups[empty_locations[0]]) == False:
+            if forward_checking and not self.forward_check(cell, backjumping):
+                if backjumping:
+                    conflicts[depth] |= self.pruned_by.get(self.wiped_out_cell, 0)
                 continue
 
-        # if no number satisfies the constraints, return None
+            if propagate and not self.propagate_counts(groups, backjumping):
+                if backjumping:
+                    conflicts[depth] |= self.pruned_by.get(self.wiped_out_cell, 0)
+                continue
+
+            depth += 1
+            entered = True
+
+
+    def conflict_depths(self, cell: int, value: int) -> int:
+        """
+        Function that is called when writing value into cell broke a group constraint. It returns the bitset of the
+        search depths (see self.cell_depth) of the filled in empty locations that share a broken group with cell: all of
+        them if the sum is too large, and the ones holding the same value if the count is too large.
+
+        :param cell: The flat index of the cell that was just filled in
+        :param value: The value that was written into cell
+        """
+
+        culprits = 0
+        for group_idx in self.groups_of_flat(cell):
+            if self.satisfies_partial_state([group_idx]):
+                continue
+            sum_broken = self.sum_broken(group_idx)
+            for other_cell in self.empty_cells_of_group(group_idx):
+                other_value = self.flat_grid[other_cell]
+                if other_cell != cell and other_value != 0 and (sum_broken or other_value == value):
+                    culprits |= 1 << int(self.cell_depth[other_cell])
+
+        return culprits
+
+
+    def add_nogood(self, assignments: typing.List[typing.Tuple[int, int]]):
+        """
+        Function that stores a nogood: a list of (cell, value) assignments that together leave no solution. The store
+        (self.nogoods) is a dict used as an LRU list, the least recently added or matched nogood is evicted when it grows
+        past self.nogood_limit. self.nogood_index maps every (cell, value) to the nogoods that contain it.
+
+        :param assignments: The (cell, value) pairs of the nogood, with the cells as flat indices
+        """
+
+        nogood = tuple(sorted(assignments))
+        if len(nogood) == 0:
+            return
+
+        if nogood in self.nogoods:
+            del self.nogoods[nogood]
+        else:
+            for assignment in nogood:
+                self.nogood_index.setdefault(assignment, set()).add(nogood)
+        self.nogoods[nogood] = None
+
+        if len(self.nogoods) > self.nogood_limit:
+            oldest = next(iter(self.nogoods))
+            del self.nogoods[oldest]
+            for assignment in oldest:
+                self.nogood_index[assignment].discard(oldest)
+                if not self.nogood_index[assignment]:
+                    del self.nogood_index[assignment]
+
+
+    def matching_nogood(self, cell: int, value: int) -> typing.Optional[int]:
+        """
+        Function that is called right after value was written into cell. If a stored nogood containing this assignment
+        now holds completely, it is moved to the back of the LRU order and the bitset of the search depths of its other
+        cells is returned. Returns None otherwise.
+
+        :param cell: The flat index of the cell that was just filled in
+        :param value: The value that was written into cell
+        """
+
+        for nogood in self.nogood_index.get((cell, value), ()):
+            if all(self.flat_grid[other_cell] == other_value for other_cell, other_value in nogood):
+                del self.nogoods[nogood]
+                self.nogoods[nogood] = None
+                culprits = 0
+                for other_cell, other_value in nogood:
+                    if other_cell != cell:
+                        culprits |= 1 << int(self.cell_depth[other_cell])
+                return culprits
+
         return None
-        
-        
-    
 
-    def start_search(self):
+
+    def allowed_values_mask(self, group_idx: int) -> int:
         """
-        Non-recursive function that starts the recursive search function above. It first fills the cell_to_group
-        data structure and computes the empty locations. Then, it starts the recursive search procedure. 
-        The result is None if there is no solution possible. Otherwise, it returns the grid that is a solution.
+        Function that returns the bitset (bit i stands for self.values[i]) of the values that can still be written into
+        an empty cell of the given group without breaking its sum or count constraint. Values that already occur
+        count_constraint times are excluded, and so are values that would push the sum over the sum constraint. The sum
+        part is only used when all numbers are non-negative, because only then can a sum never go down again.
+
+        With self.sum_bounds set, the other empty cells of the group are taken into account as well: each of them will
+        add at least min(numbers), so a value is only allowed if the sum stays reachable. With self.exact_sums set, each
+        of them adds at most max(numbers) and the sum must end up exactly at the sum constraint, so values that are too
+        small are removed as well (for the last empty cell of a group only one value is left).
+
+        :param group_idx: The index of the group
+        """
+
+        mask = self.full_domain
+        count_constraint = self.constraints[group_idx][1]
+        for value, count in self.group_counts[group_idx].items():
+            if count >= count_constraint and value in self.value_index:
+                mask &= ~(1 << self.value_index[value])
+
+        room = self.constraints[group_idx][0] - self.group_sums[group_idx]
+        other_empty = self.group_empty[group_idx] - 1
+
+        if self.prune_sums:
+            if self.sum_bounds:
+                mask &= (1 << self.count_values_up_to(room - other_empty * self.values[0])) - 1
+            else:
+                mask &= (1 << self.count_values_up_to(room)) - 1
+
+        if self.exact_sums:
+            mask &= ~((1 << self.count_values_up_to(room - other_empty * self.values[-1] - 1)) - 1)
+
+        return mask
+
+
+    def count_values_up_to(self, limit: int) -> int:
+        """
+        Function that returns the number of values in self.values (which is sorted) that are at most limit, using
+        binary search. The mask (1 << result) - 1 is the bitset of exactly these values.
+
+        :param limit: The largest value to count
+        """
+
+        low, high = 0, len(self.values)
+        while low < high:
+            middle = (low + high) // 2
+            if self.values[middle] <= limit:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+
+    def satisfies_sum_bounds(self, group_idx: int) -> bool:
+        """
+        Function that checks whether the sum constraint of the given group can still be met once its empty cells are
+        filled in: every empty cell adds at least min(numbers), so sum + empty * min(numbers) may not exceed the sum
+        constraint (only used when all numbers are non-negative, like the sum part of allowed_values_mask). With
+        self.exact_sums set, the sum must end up exactly at the sum constraint, so sum + empty * max(numbers) may not
+        fall below it either. Requires init_group_state and init_values to have been called.
+
+        :param group_idx: The index of the group
+        """
+
+        sum_constraint = self.constraints[group_idx][0]
+        if self.prune_sums and self.group_sums[group_idx] + self.group_empty[group_idx] * self.values[0] > sum_constraint:
+            return False
+        if self.exact_sums and self.group_sums[group_idx] + self.group_empty[group_idx] * self.values[-1] < sum_constraint:
+            return False
+
+        return True
+
+
+    def init_values(self):
+        """
+        Function that sorts self.numbers into self.values, the order in which values are tried. Bit i of a domain
+        bitset stands for self.values[i].
+        """
+
+        self.values = sorted(self.numbers)
+        self.value_index = {value: idx for idx, value in enumerate(self.values)}
+        self.full_domain = (1 << len(self.values)) - 1
+        self.prune_sums = len(self.values) > 0 and self.values[0] >= 0
+        # the dtype of arrays of domain bitsets, which only fit in an int64 for up to 63 numbers
+        self.domain_dtype = np.int64 if len(self.values) <= 63 else object
+
+
+    def init_group_empty_cells(self, empty_locations: np.ndarray):
+        """
+        Function that lists the empty locations of every group, in the order of empty_locations: the flat indices of
+        the empty locations of group i are self.group_empty_cells[self.group_empty_ptr[i]:self.group_empty_ptr[i+1]]
+        (see empty_cells_of_group). These are the cells that forward checking has to update, and the cells that can be
+        the cause of a broken group during the search.
+
+        :param empty_locations: the flat indices of the empty locations that still need a value from self.numbers
+        """
+
+        # the (group, cell) pairs of the empty locations, gathered from the rows of the cell -> group incidence
+        group_starts = self.cell_group_ptr[empty_locations]
+        num_groups_of_cell = self.cell_group_ptr[empty_locations + 1] - group_starts
+        row_offsets = np.repeat(np.cumsum(num_groups_of_cell, dtype=group_starts.dtype) - num_groups_of_cell
+                                - group_starts, num_groups_of_cell)
+        row_offsets -= np.arange(len(row_offsets), dtype=row_offsets.dtype)
+        entry_groups = self.cell_group_idx[-row_offsets]
+        del row_offsets
+
+        self.group_empty_ptr = np.zeros(self.num_groups + 1, dtype=np.int64)
+        np.cumsum(np.bincount(entry_groups, minlength=self.num_groups), out=self.group_empty_ptr[1:])
+        order = np.argsort(entry_groups, kind="stable")
+        del entry_groups
+        self.group_empty_cells = np.repeat(empty_locations, num_groups_of_cell)[order]
+
+
+    def empty_cells_of_group(self, group_idx: int) -> typing.List[int]:
+        """
+        Function that returns the flat indices of the empty locations of the given group (see init_group_empty_cells),
+        filled in or not.
+
+        :param group_idx: The index of the group
+        """
+
+        return self.group_empty_cells[self.group_empty_ptr[group_idx]:self.group_empty_ptr[group_idx + 1]].tolist()
+
+
+    def init_domains(self, empty_locations: np.ndarray) -> bool:
+        """
+        Function that builds the domain of every empty location as a bitset over self.values (the sorted numbers), and
+        removes the values that already break a constraint given the filled in cells. Returns False if some domain is
+        empty, in which case there is no solution. Requires init_group_state, init_values and init_group_empty_cells to
+        have been called.
+
+        The domains are kept in self.domains, an array indexed by flat cell index (of self.domain_dtype). The reasons
+        of the prunes (self.pruned_by, only recorded for backjumping) are bitsets over the search depths, which do not
+        fit in an array; they are kept in a dict that only holds the cells with a reason.
+
+        :param empty_locations: the flat indices of the empty locations that still need a value from self.numbers
+        """
+
+        self.domain_trail = []
+        self.pruned_by = {}
+        self.domains = np.zeros(self.grid.size, dtype=self.domain_dtype)
+
+        # every empty cell of a group gets the same mask
+        masks = [self.allowed_values_mask(group_idx) for group_idx in range(self.num_groups)]
+        for cell in empty_locations.tolist():
+            domain = self.full_domain
+            for group_idx in self.groups_of_flat(cell):
+                domain &= masks[group_idx]
+            if domain == 0:
+                return False
+            self.domains[cell] = domain
+
+        return True
+
+
+    def forward_check(self, cell: int, record_reasons: bool = False) -> bool:
+        """
+        Function that is called right after a value has been written into cell. It removes the values that are no longer
+        allowed from the domains of the empty cells that share a group with cell. Every change is pushed onto
+        self.domain_trail so that it can be undone with undo_domains. Returns False as soon as a domain becomes empty,
+        the cell with the empty domain is then stored in self.wiped_out_cell.
+
+        :param cell: The flat index of the cell that was just filled in
+        :param record_reasons: If True (used for backjumping), add the search depths of the filled in empty locations of
+                               the group to self.pruned_by of every cell whose domain shrinks: a value is removed
+                               because of the whole sum or count of the group, not only because of cell.
+        """
+
+        flat_grid = self.flat_grid
+        domains = self.domains
+        for group_idx in self.groups_of_flat(cell):
+            mask = self.allowed_values_mask(group_idx)
+            reason = None
+            for other_cell in self.empty_cells_of_group(group_idx):
+                if flat_grid[other_cell] != 0:
+                    continue
+                domain = int(domains[other_cell])
+                if domain & mask != domain:
+                    self.domain_trail.append((other_cell, domain, self.pruned_by.get(other_cell, 0)))
+                    domains[other_cell] = domain & mask
+                    if record_reasons:
+                        if reason is None:
+                            reason = self.filled_depths(group_idx)
+                        self.pruned_by[other_cell] = self.pruned_by.get(other_cell, 0) | reason
+                    if domain & mask == 0:
+                        self.wiped_out_cell = other_cell
+                        return False
+
+        return True
+
+
+    def filled_depths(self, group_idx: int) -> int:
+        """
+        Function that returns the bitset of the search depths (see self.cell_depth) of the empty locations of the given
+        group that are filled in at the moment.
+
+        :param group_idx: The index of the group
+        """
+
+        depths = 0
+        for cell in self.empty_cells_of_group(group_idx):
+            if self.flat_grid[cell] != 0:
+                depths |= 1 << int(self.cell_depth[cell])
+
+        return depths
+
+
+    def undo_domains(self, trail_length: int):
+        """
+        Function that restores the domains that were changed since self.domain_trail had the given length.
+
+        :param trail_length: The length of self.domain_trail to go back to
+        """
+
+        while len(self.domain_trail) > trail_length:
+            cell, domain, pruned_by = self.domain_trail.pop()
+            self.domains[cell] = domain
+            if pruned_by:
+                self.pruned_by[cell] = pruned_by
+            else:
+                self.pruned_by.pop(cell, None)
+
+
+    def propagate_counts(self, group_queue: typing.List[int], record_reasons: bool = False) -> bool:
+        """
+        Function that makes the domains of the empty cells consistent with the count constraints (generalized arc
+        consistency, see revise_counts), starting from the groups in group_queue. Every group whose domains change puts
+        the other groups of the changed cells back on the queue, until nothing changes any more (a fixpoint). Every
+        change is pushed onto self.domain_trail. Returns False as soon as some group cannot be filled in any more, the
+        cell that is blamed is then stored in self.wiped_out_cell.
+
+        :param group_queue: The indices of the groups to start from, used as a stack
+        :param record_reasons: If True (used for backjumping), add the reason of every change to self.pruned_by, see
+                               revise_counts
+        """
+
+        queued = set(group_queue)
+        while group_queue:
+            group_idx = group_queue.pop()
+            queued.discard(group_idx)
+            changed_cells = self.revise_counts(group_idx, record_reasons)
+            if changed_cells is None:
+                return False
+            for cell in changed_cells:
+                for other_group_idx in self.groups_of_flat(cell):
+                    if other_group_idx not in queued:
+                        queued.add(other_group_idx)
+                        group_queue.append(other_group_idx)
+
+        return True
+
+
+    def revise_counts(self, group_idx: int, record_reasons: bool = False) -> typing.Optional[typing.List[int]]:
+        """
+        Function that removes the values from the domains of the empty cells of the given group that cannot be part of
+        any filling of the group that satisfies its count constraint. With a count constraint of 1 the group is an
+        all-different constraint and exactly the values that are in no complete matching of cells to values are removed
+        (see all_different_domains). Otherwise a value is removed from the other cells once the filled in cells and the
+        cells that can only take that value reach the count constraint (see capped_domains). Returns the cells whose
+        domain changed (as flat indices), or None if the group can no longer be filled in.
+
+        :param group_idx: The index of the group
+        :param record_reasons: If True, add the search depths of the filled in empty locations of the group and the
+                               reasons of the domains of its empty cells to self.pruned_by of every changed cell: a
+                               change depends on all of them
+        """
+
+        cells = [cell for cell in self.empty_cells_of_group(group_idx) if self.flat_grid[cell] == 0]
+        if not cells:
+            return []
+
+        mask = self.allowed_values_mask(group_idx)
+        old_domains = [int(self.domains[cell]) for cell in cells]
+        domains = [domain & mask for domain in old_domains]
+        count_constraint = self.constraints[group_idx][1]
+        if count_constraint == 1:
+            new_domains = None if 0 in domains else self.all_different_domains(domains)
+        else:
+            new_domains = self.capped_domains(domains, self.group_counts[group_idx], count_constraint)
+
+        reason = 0
+        if record_reasons:
+            reason = self.filled_depths(group_idx)
+            for cell in cells:
+                reason |= self.pruned_by.get(cell, 0)
+
+        if new_domains is None:
+            cell = cells[0]
+            self.domain_trail.append((cell, old_domains[0], self.pruned_by.get(cell, 0)))
+            if reason:
+                self.pruned_by[cell] = self.pruned_by.get(cell, 0) | reason
+            self.wiped_out_cell = cell
+            return None
+
+        changed_cells = []
+        for cell, old_domain, domain in zip(cells, old_domains, new_domains):
+            if domain != old_domain:
+                self.domain_trail.append((cell, old_domain, self.pruned_by.get(cell, 0)))
+                self.domains[cell] = domain
+                if reason:
+                    self.pruned_by[cell] = self.pruned_by.get(cell, 0) | reason
+                changed_cells.append(cell)
+
+        return changed_cells
+
 
-        You do not need to change this function.
+    @staticmethod
+    def all_different_domains(domains: typing.List[int]) -> typing.Optional[typing.List[int]]:
         """
+        Function that filters the domains (bitsets) of cells that must all get different values (Regin's algorithm).
+        It finds a maximum matching of cells to values with augmenting paths; if not every cell is matched there is no
+        solution and None is returned. A value stays in the domain of a cell only if some complete matching gives it to
+        that cell: if it is the matched value, if it can be reached from a value that is not matched, or if the cell and
+        the value are in the same strongly connected component of the graph with the matched edges from cell to value
+        and the other edges from value to cell.
 
+        :param domains: The domains of the cells, as bitsets over self.values
+        """
+
+        num_cells = len(domains)
+        cell_bits = [[bit for bit in range(domain.bit_length()) if domain >> bit & 1] for domain in domains]
+        matched_bit = [-1] * num_cells
+        matched_cell = {}
+
+        # maximum matching, with a breadth first search for an augmenting path from every cell
+        for start in range(num_cells):
+            # parent[cell] = (previous cell, bit): the previous cell can take bit, which cell holds now
+            parent = {start: None}
+            queue = [start]
+            end = None
+            for cell in queue:
+                for bit in cell_bits[cell]:
+                    owner = matched_cell.get(bit)
+                    if owner is None:
+                        end = (cell, bit)
+                        break
+                    if owner not in parent:
+                        parent[owner] = (cell, bit)
+                        queue.append(owner)
+                if end is not None:
+                    break
+            if end is None:
+                return None
+
+            cell, bit = end
+            while cell is not None:
+                matched_bit[cell] = bit
+                matched_cell[bit] = cell
+                cell, bit = parent[cell] or (None, None)
+
+        # nodes 0..num_cells-1 are the cells, num_cells + bit is the value of that bit
+        num_bits = max(domain.bit_length() for domain in domains)
+        edges = [[num_cells + matched_bit[cell]] for cell in range(num_cells)] + [[] for bit in range(num_bits)]
+        for cell in range(num_cells):
+            for bit in cell_bits[cell]:
+                if bit != matched_bit[cell]:
+                    edges[num_cells + bit].append(cell)
+
+        # the values that can be reached from a value that is not matched
+        reached = [num_cells + bit for bit in range(num_bits) if bit not in matched_cell]
+        is_reached = [False] * len(edges)
+        for node in reached:
+            is_reached[node] = True
+        for node in reached:
+            for next_node in edges[node]:
+                if not is_reached[next_node]:
+                    is_reached[next_node] = True
+                    reached.append(next_node)
+
+        # strongly connected components (iterative Tarjan)
+        index = [-1] * len(edges)
+        low = [0] * len(edges)
+        component = [-1] * len(edges)
+        on_stack = [False] * len(edges)
+        stack = []
+        counter = 0
+        for root in range(len(edges)):
+            if index[root] >= 0:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, 0)]
+            while work:
+                node, edge_idx = work[-1]
+                if edge_idx < len(edges[node]):
+                    work[-1] = (node, edge_idx + 1)
+                    next_node = edges[node][edge_idx]
+                    if index[next_node] < 0:
+                        index[next_node] = low[next_node] = counter
+                        counter += 1
+                        stack.append(next_node)
+                        on_stack[next_node] = True
+                        work.append((next_node, 0))
+                    elif on_stack[next_node]:
+                        low[node] = min(low[node], index[next_node])
+                    continue
+
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = node
+                        if member == node:
+                            break
+
+        new_domains = []
+        for cell in range(num_cells):
+            domain = 0
+            for bit in cell_bits[cell]:
+                if (bit == matched_bit[cell] or is_reached[num_cells + bit]
+                        or component[cell] == component[num_cells + bit]):
+                    domain |= 1 << bit
+            new_domains.append(domain)
+
+        return new_domains
+
+
+    def capped_domains(self, domains: typing.List[int], counts: typing.Dict[int, int],
+                       count_constraint: int) -> typing.Optional[typing.List[int]]:
+        """
+        Function that filters the domains (bitsets) of the empty cells of a group with the given count constraint: a
+        cell whose domain has one value left will get that value, so once the filled in cells (counts) and these cells
+        hold a value count_constraint times, it is removed from the domains of the other cells. This is repeated until
+        nothing changes. Returns None if some domain becomes empty or a value is forced more often than allowed.
+
+        :param domains: The domains of the empty cells of the group, as bitsets over self.values
+        :param counts: The number of times every value occurs in the filled in cells of the group
+        :param count_constraint: The maximum number of times a value may occur in the group
+        """
+
+        domains = list(domains)
+        changed = True
+        while changed:
+            changed = False
+            forced = {}
+            for domain in domains:
+                if domain == 0:
+                    return None
+                if domain & (domain - 1) == 0:
+                    forced[domain] = forced.get(domain, 0) + 1
+
+            for bit_mask, num_forced in forced.items():
+                total = counts.get(self.values[bit_mask.bit_length() - 1], 0) + num_forced
+                if total > count_constraint:
+                    return None
+                if total == count_constraint:
+                    for idx, domain in enumerate(domains):
+                        if domain != bit_mask and domain & bit_mask:
+                            domains[idx] = domain & ~bit_mask
+                            changed = True
+
+        return domains
+
+
+    def select_next_cell(self, empty_locations: np.ndarray, depth: int):
+        """
+        Function that implements the minimum remaining values heuristic. Among empty_locations[depth:] it picks the cell
+        with the fewest values left in its domain, breaking ties by the number of groups the cell is in (most groups
+        first), and swaps it to position depth so that it is filled in next. The domain sizes and degrees of all
+        candidates are computed with array operations.
+
+        :param empty_locations: the flat indices of the empty locations that still need a value from self.numbers
+        :param depth: the index in empty_locations of the next cell to fill in
+        """
+
+        candidates = empty_locations[depth:]
+        domains = self.domains[candidates]
+        if domains.dtype == object:
+            sizes = np.array([bin(domain).count("1") for domain in domains.tolist()], dtype=np.int64)
+        else:
+            sizes = np.bitwise_count(domains)
+        degrees = np.where(sizes == sizes.min(),
+                           self.cell_group_ptr[candidates + 1] - self.cell_group_ptr[candidates], -1)
+        ties = np.flatnonzero(degrees == degrees.max())
+
+        # with a seed, ties are broken at random instead of by position
+        best_idx = depth + int(ties[0])
+        if self.rng is not None and len(ties) > 1:
+            best_idx = depth + int(ties[int(self.rng.integers(len(ties)))])
+
+        empty_locations[depth], empty_locations[best_idx] = empty_locations[best_idx], empty_locations[depth]
+
+
+    def ordered_values(self, cell: int) -> typing.List[int]:
+        """
+        Function that returns the values left in the domain of cell in the order in which they should be tried. With
+        value ordering "ascending" this is from small to large. With "lcv" (least constraining value) the values that
+        remove the fewest values from the domains of the empty cells sharing a group with cell come first.
+
+        :param cell: The flat index of the empty cell
+        """
+
+        domain = int(self.domains[cell])
+        values = [self.values[idx] for idx in range(len(self.values)) if domain >> idx & 1]
+        if self.rng is not None:
+            # with a seed, the values come in random order (lcv below keeps it among values that remove as many)
+            values = [values[idx] for idx in self.rng.permutation(len(values)).tolist()]
+        if self.value_ordering == "ascending":
+            return values
+
+        removed = {}
+        groups = self.groups_of_flat(cell)
+        for value in values:
+            self.set_flat(cell, value)
+            removed[value] = 0
+            for group_idx in groups:
+                mask = self.allowed_values_mask(group_idx)
+                for other_cell in self.empty_cells_of_group(group_idx):
+                    if self.flat_grid[other_cell] == 0:
+                        removed[value] += bin(int(self.domains[other_cell]) & ~mask).count("1")
+        self.set_flat(cell, 0)
+
+        return sorted(values, key=lambda value: removed[value])
+
+
+    def find_components(self, empty_locations: np.ndarray) -> typing.Tuple[typing.List[np.ndarray], np.ndarray]:
+        """
+        Function that splits the empty locations into parts that do not share a group: two empty cells are in the same
+        component if they are connected through a chain of groups that each hold an empty cell of the chain. The values
+        of one component never affect the constraints of another, so every component can be searched on its own.
+        Returns the components (every one an array of flat indices in the order of empty_locations, in order of their
+        first cell) and the free cells, which are in no group at all and can take any value.
+
+        :param empty_locations: The flat indices of the empty locations in the order of prepare_search
+        """
+
+        # union-find over the groups, every empty cell joins all of its groups
+        parent = list(range(self.num_groups))
+
+        def find(group_idx):
+            while parent[group_idx] != group_idx:
+                parent[group_idx] = parent[parent[group_idx]]
+                group_idx = parent[group_idx]
+            return group_idx
+
+        for cell in empty_locations.tolist():
+            groups = self.groups_of_flat(cell)
+            root = find(groups[0]) if groups else None
+            for group_idx in groups[1:]:
+                other_root = find(group_idx)
+                if other_root != root:
+                    parent[other_root] = root
+
+        components = {}
+        free_cells = []
+        for cell in empty_locations.tolist():
+            groups = self.groups_of_flat(cell)
+            if groups:
+                components.setdefault(find(groups[0]), []).append(cell)
+            else:
+                free_cells.append(cell)
+
+        dtype = empty_locations.dtype
+        return ([np.array(component, dtype=dtype) for component in components.values()],
+                np.array(free_cells, dtype=dtype))
+
+
+    def search_components(self, empty_locations: np.ndarray) -> typing.Optional[np.ndarray]:
+        """
+        Version of search that searches every component of find_components on its own, one after the other, so that a
+        failure in one component never makes the search go back through the others: the cost is the sum of the costs
+        of the components instead of their product. The free cells get the smallest number without any search.
+        Returns None if some component has no solution (and leaves the grid as it was), the filled in grid otherwise.
+
+        :param empty_locations: The flat indices of the empty locations in the order of prepare_search
+        """
+
+        components, free_cells = self.find_components(empty_locations)
+        if len(free_cells) > 0 and not self.values:
+            return None
+        for cell in free_cells.tolist():
+            self.set_flat(cell, self.values[0])
+
+        for component in components:
+            if self.search(component) is None:
+                for cell in empty_locations.tolist():
+                    self.set_flat(cell, 0)
+                return None
+
+        return self.grid
+
+
+    def count_component_solutions(self, empty_locations: np.ndarray, limit: typing.Optional[int] = None) -> int:
+        """
+        Version of count_solutions for the components of find_components: the number of solutions is the product of
+        the numbers of solutions of the components, and every free cell multiplies it by the number of numbers. Every
+        component is counted up to limit, which is enough to know if the product reaches it. The grid is left as it was.
+
+        :param empty_locations: The flat indices of the empty locations in the order of prepare_search
+        :param limit: The number of solutions after which to stop counting, or None to count all solutions
+        """
+
+        components, free_cells = self.find_components(empty_locations)
+        count = len(self.values) ** len(free_cells)
+
+        for component in components:
+            if count == 0:
+                break
+            component_count = 0
+            for solution in self.search_solutions(component):
+                component_count += 1
+                if component_count == limit:
+                    break
+            for cell in component.tolist():
+                self.set_flat(cell, 0)
+            count *= component_count
+
+        return count if limit is None else min(count, limit)
+
+
+    def prepare_search(self, forward_checking: bool = False, variable_ordering: str = "static",
+                       value_ordering: str = "ascending", backjumping: bool = False, nogood_limit: int = 0,
+                       sum_bounds: bool = False, exact_sums: bool = False, decompose: bool = False,
+                       propagation: str = "none", node_limit: typing.Optional[int] = None,
+                       should_stop: typing.Optional[typing.Callable[[], bool]] = None, seed: typing.Optional[int] = None,
+                       restarts: str = "none", restart_base: typing.Optional[int] = None, stats=None) -> typing.Optional[np.ndarray]:
+        """
+        Function that sets up everything the search functions above need. It fills the cell_to_group data structure,
+        builds the incremental group state (and the domains when forward checking) and computes the empty locations in
+        the order in which they are filled in. Returns the empty locations as an array of flat indices
+        row_idx * self.width + col_idx (int32 unless the grid needs int64), or None if some empty location has no
+        value left at all (so there is no solution). The search settings are stored on the object and
+        self.nodes_expanded is reset.
+
+        :param forward_checking: If True, prune the domains of the empty cells after every assignment.
+        :param variable_ordering: The order in which the empty cells are filled in. "static" is row by row, "degree"
+                                  puts the cells that are in the most groups first, and "mrv" (minimum remaining values)
+                                  picks the cell with the smallest domain at every step, with degree as tie-break.
+        :param value_ordering: The order in which values are tried, "ascending" or "lcv" (least constraining value).
+                               Every ordering other than "static"/"ascending" needs the domains, so it implies
+                               forward_checking.
+        :param backjumping: If True, jump back to the cause of a failure instead of the previous cell.
+        :param nogood_limit: The number of nogoods to remember (least recently used ones are evicted), 0 to remember
+                             none. Nogoods come from backjumping, so a positive limit implies backjumping.
+        :param sum_bounds: If True, prune as soon as the sum constraint of a group can no longer be met by filling its
+                           empty cells with the smallest number (see satisfies_sum_bounds), and take this into account
+                           in the domains when forward checking.
+        :param exact_sums: If True, the groups must sum up to exactly their sum constraint instead of at most to it. The
+                           bounds on both sides are checked, so this implies sum_bounds.
+        :param decompose: If True, start_search and count_solutions search the independent parts of the problem (see
+                          find_components) one after the other instead of as one product, and fill in the cells that
+                          are in no group without search.
+        :param propagation: Propagation of the count constraints (see propagate_counts). "none" does none,
+                            "preprocess" makes the domains consistent once before the search, and "search" does so
+                            after every assignment as well. It needs the domains, so it implies forward_checking.
+        :param node_limit: If given, the search stops once this many values have been tried.
+        :param should_stop: If given, called every 256 values tried; the search stops as soon as it returns True (used
+                            for deadlines and cancellation, see csp_budget). A stopped search leaves the grid as it was
+                            and sets self.stopped, so that "no solution found in time" can be told apart from "no
+                            solution". Counts of count_solutions are then incomplete.
+        :param seed: If given, ties in the variable ordering (all cells for "static") and the order of the values are
+                     broken at random with a numpy generator seeded with seed. The values are then tried from a list,
+                     which needs the domains, so this implies forward_checking.
+        :param restarts: "none", or the schedule of restarts of start_search, "luby" or "geometric" (see
+                         search_restarts). Restarts need random choices, so they imply seed 0 if no seed is given.
+        :param restart_base: The number of values tried in the first run of the restart schedule. None is 4 times the
+                             number of empty locations: a shorter run can hardly reach a solution.
+        :param stats: Optional csp_stats.SearchStats (or an object with the same methods) that collects node, backtrack
+                      and check counts and the time spent in every phase, and calls the tracing hooks. None (the
+                      default) collects nothing.
+        """
+
+        if variable_ordering not in ("static", "degree", "mrv"):
+            raise ValueError(f"unknown variable ordering {variable_ordering!r}")
+        if value_ordering not in ("ascending", "lcv"):
+            raise ValueError(f"unknown value ordering {value_ordering!r}")
+        if propagation not in ("none", "preprocess", "search"):
+            raise ValueError(f"unknown propagation {propagation!r}")
+        if restarts not in ("none", "luby", "geometric"):
+            raise ValueError(f"unknown restart schedule {restarts!r}")
+        if restarts != "none" and seed is None:
+            seed = 0
+
+        self.forward_checking = (forward_checking or variable_ordering != "static" or value_ordering != "ascending"
+                                 or propagation != "none" or seed is not None)
+        self.variable_ordering = variable_ordering
+        self.value_ordering = value_ordering
+        self.backjumping = backjumping or nogood_limit > 0
+        self.nogood_limit = nogood_limit
+        self.sum_bounds = sum_bounds or exact_sums
+        self.exact_sums = exact_sums
+        self.decompose = decompose
+        self.propagation = propagation
+        self.node_limit = node_limit
+        self.should_stop = should_stop
+        self.stopped = False
+        self.rng = None if seed is None else np.random.default_rng(seed)
+        self.restarts = restarts
+        self.restart_base = restart_base
+        self.nogoods = {}
+        self.nogood_index = {}
+        self.stats = stats
+        self.nodes_expanded = 0
+
+        if stats is not None:
+            stats.start_phase("fill_cell_to_groups")
         self.fill_cell_to_groups()
-        empty_locations = [(row_idx, col_idx) for row_idx in range(self.height) for col_idx in range(self.width) if self.grid[row_idx,col_idx]==0]
+        if stats is not None:
+            stats.end_phase("fill_cell_to_groups")
+            stats.start_phase("setup")
+
+        self.init_group_state()
+        self.init_values()
+        # the search keeps its state per flat cell index in arrays, the groups of a cell are read from the compiled
+        # incidence, so no Python object is made per cell of the grid
+        empty_locations = np.flatnonzero(self.flat_grid == 0).astype(self.index_dtype(self.grid.size))
+        self.cell_depth = np.zeros(self.grid.size, dtype=self.index_dtype(self.grid.size))
+
+        if self.rng is not None:
+            self.shuffle_locations(empty_locations)
+        elif variable_ordering == "degree":
+            self.sort_by_degree(empty_locations)
+
+        self.init_group_empty_cells(empty_locations)
+        domains_ok = not self.forward_checking or self.init_domains(empty_locations)
+        if domains_ok and propagation != "none":
+            domains_ok = self.propagate_counts(list(range(self.num_groups)))
+        if stats is not None:
+            stats.end_phase("setup")
+
+        return empty_locations if domains_ok else None
+
+
+    def start_search(self, **search_settings):
+        """
+        Function that starts the search function above. It first fills the cell_to_group
+        data structure and computes the empty locations (see prepare_search). Then, it starts the search procedure. 
+        The result is None if there is no solution possible. Otherwise, it returns the grid that is a solution.
+        The number of values that were tried is stored in self.nodes_expanded.
+
+        :param search_settings: The settings of prepare_search (forward_checking, variable_ordering, value_ordering,
+                                backjumping, nogood_limit, sum_bounds, exact_sums, decompose, propagation,
+                                node_limit, should_stop, seed, restarts, restart_base, stats)
+        """
+
+        empty_locations = self.prepare_search(**search_settings)
+        if empty_locations is None:
+            return None
+
+        if self.decompose:
+            return self.search_components(empty_locations)
         return self.search(empty_locations)
+
+
+    def iter_solutions(self, **search_settings) -> typing.Iterator[np.ndarray]:
+        """
+        Generator that yields every solution, one at a time, as a copy of the filled in grid. Solutions are found
+        lazily by search_solutions, with the same incremental version of the satisfies_group_constraints checks, and
+        are not stored. When the generator is exhausted or closed, self.grid is back to the starting grid.
+
+        :param search_settings: The settings of prepare_search (forward_checking, variable_ordering, value_ordering,
+                                backjumping, nogood_limit, sum_bounds, exact_sums, decompose, propagation,
+                                node_limit, should_stop, seed, restarts, restart_base, stats)
+        """
+
+        empty_locations = self.prepare_search(**search_settings)
+        if empty_locations is None:
+            return
+
+        try:
+            for solution in self.search_solutions(empty_locations):
+                yield solution.copy()
+        finally:
+            # the caller may stop early, leave the grid as it was
+            for cell in empty_locations.tolist():
+                self.set_flat(cell, 0)
+
+
+    def count_solutions(self, limit: typing.Optional[int] = None, **search_settings) -> int:
+        """
+        Function that counts the solutions, stopping as soon as limit solutions have been found. To check that a puzzle
+        has exactly one solution, use count_solutions(limit=2) == 1.
+
+        :param limit: The number of solutions after which to stop counting, or None to count all solutions
+        :param search_settings: The settings of prepare_search (forward_checking, variable_ordering, value_ordering,
+                                backjumping, nogood_limit, sum_bounds, exact_sums, decompose, propagation,
+                                node_limit, should_stop, seed, restarts, restart_base, stats)
+        """
+
+        count = 0
+        if limit is not None and limit <= 0:
+            return count
+
+        empty_locations = self.prepare_search(**search_settings)
+        if empty_locations is None:
+            return count
+
+        if self.decompose:
+            return self.count_component_solutions(empty_locations, limit)
+
+        for solution in self.search_solutions(empty_locations):
+            count += 1
+            if count == limit:
+                break
+
+        for cell in empty_locations.tolist():
+            self.set_flat(cell, 0)
+
+        return count
     
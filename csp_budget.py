@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+import typing
+
+import numpy as np
+
+from csp import CSP
+
+
+# the status of a budgeted solve
+SOLVED = "solved"
+NO_SOLUTION = "no_solution"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+
+
+class CancellationToken:
+    def __init__(self):
+        """
+        Flag that another thread (or an asyncio task, see async_budgeted_search) sets to stop a budgeted search. The
+        search notices it within 256 values tried.
+        """
+
+        self.event = threading.Event()
+
+
+    def cancel(self):
+        """
+        Function that asks every search that uses this token to stop.
+        """
+
+        self.event.set()
+
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+
+class SolveResult(typing.NamedTuple):
+    status: str
+    solution: typing.Optional[np.ndarray]
+    nodes_expanded: int
+    elapsed: float
+
+
+def budgeted_search(csp: CSP, time_limit: typing.Optional[float] = None, node_limit: typing.Optional[int] = None,
+                    token: typing.Optional[CancellationToken] = None, **search_settings) -> SolveResult:
+    """
+    Version of CSP.start_search with a budget. The search stops when it has run for time_limit seconds, has tried
+    node_limit values or token is cancelled, whichever comes first, and then leaves csp.grid as it was. The status of
+    the result is SOLVED (the solution is csp.grid), NO_SOLUTION (the whole search space was searched), TIMED_OUT (the
+    time or node budget ran out) or CANCELLED.
+
+    :param csp: The problem to solve
+    :param time_limit: The wall clock budget in seconds, or None for no deadline
+    :param node_limit: The number of values the search may try, or None for no limit
+    :param token: A token that can stop the search from another thread, or None
+    :param search_settings: The other settings of CSP.prepare_search
+    """
+
+    start = time.monotonic()
+    deadline = None if time_limit is None else start + time_limit
+
+    def should_stop() -> bool:
+        return (token is not None and token.cancelled) or (deadline is not None and time.monotonic() >= deadline)
+
+    solution = csp.start_search(node_limit=node_limit,
+                                should_stop=should_stop if token is not None or deadline is not None else None,
+                                **search_settings)
+    elapsed = time.monotonic() - start
+
+    if solution is not None:
+        status = SOLVED
+    elif not csp.stopped:
+        status = NO_SOLUTION
+    elif token is not None and token.cancelled:
+        status = CANCELLED
+    else:
+        status = TIMED_OUT
+
+    return SolveResult(status, solution, csp.nodes_expanded, elapsed)
+
+
+async def async_budgeted_search(csp: CSP, time_limit: typing.Optional[float] = None,
+                                node_limit: typing.Optional[int] = None,
+                                token: typing.Optional[CancellationToken] = None, executor=None,
+                                **search_settings) -> SolveResult:
+    """
+    Asyncio version of budgeted_search: the search runs in a thread of executor (the default executor of the event
+    loop if None), so the event loop is not blocked. If the awaiting task is cancelled, the token is cancelled as well
+    so that the thread stops searching soon after.
+
+    :param csp: The problem to solve, it should not be used elsewhere while the search runs
+    :param time_limit: The wall clock budget in seconds, or None for no deadline
+    :param node_limit: The number of values the search may try, or None for no limit
+    :param token: A token that can stop the search, one is made if None
+    :param executor: The concurrent.futures executor to run the search in
+    :param search_settings: The other settings of CSP.prepare_search
+    """
+
+    token = token or CancellationToken()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, lambda: budgeted_search(csp, time_limit, node_limit, token,
+                                                                            **search_settings))
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
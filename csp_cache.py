@@ -0,0 +1,183 @@
+import collections
+import hashlib
+import io
+import sqlite3
+import threading
+import typing
+
+import numpy as np
+
+from csp import CSP
+
+
+# search settings that change which grids are solutions, the other settings only change how one is found
+SEMANTIC_SETTINGS = ("exact_sums",)
+
+
+def problem_key(csp: CSP, **search_settings) -> str:
+    """
+    Function that returns the canonical key of the problem of csp: a SHA-256 over the shape and values of the grid
+    (independent of its dtype), the sorted numbers, the groups with their constraints and the search settings that
+    change the set of solutions. The cells of every group are sorted and so are the (group, constraint) pairs, so the
+    order in which groups and cells are listed does not change the key. Two problems with the same key have the same
+    solutions.
+
+    :param csp: The problem, its groups are compiled (see CSP.compile_groups) if that was not done yet
+    :param search_settings: The settings of CSP.prepare_search that will be used for the solve
+    """
+
+    if csp.group_cells is None:
+        csp.compile_groups()
+
+    constraints = [tuple(None if bound is None else int(bound) for bound in constraint) for constraint in csp.constraints]
+    semantics = [(name, bool(search_settings.get(name, False))) for name in SEMANTIC_SETTINGS]
+
+    # every group as its sorted flat cell indices next to its constraint, sorted (None sorts before every bound)
+    group_ptr = csp.group_ptr.tolist()
+    group_cells = csp.group_cells.tolist()
+    groups = [(sorted(group_cells[group_ptr[group_idx]:group_ptr[group_idx + 1]]),
+               [(bound is not None, bound or 0) for bound in constraints[group_idx]])
+              for group_idx in range(csp.num_groups)]
+    groups.sort()
+
+    digest = hashlib.sha256()
+    digest.update(repr((csp.grid.shape, sorted(int(number) for number in csp.numbers), groups, semantics)).encode())
+    digest.update(np.ascontiguousarray(csp.grid, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+class SolveCache:
+    def __init__(self, maxsize: int = 1024, path: typing.Optional[str] = None):
+        """
+        Bounded LRU cache of solve results, keyed by problem_key. Both solutions and "no solution" are stored. With a
+        path, results are also written to (and looked up in) an SQLite file, so that they are shared between processes
+        and survive restarts; the in-memory LRU stays in front of it. A cache can be shared by threads (e.g. the
+        executor threads of csp_budget.async_budgeted_search), every method holds self.lock.
+
+        :param maxsize: The number of results that are kept in memory
+        :param path: The SQLite file to persist results in, or None to keep them in memory only
+        """
+
+        self.maxsize = maxsize
+        self.path = path
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, solution BLOB)")
+            self.connection.commit()
+
+
+    def get(self, key: str) -> typing.Tuple[bool, typing.Optional[np.ndarray]]:
+        """
+        Function that looks up key and returns (found, solution), where solution is None for a problem without
+        solution. A result that is only on disk is moved into the in-memory LRU.
+
+        :param key: The key of the problem, see problem_key
+        """
+
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return True, self.results[key]
+
+            if self.connection is not None:
+                row = self.connection.execute("SELECT solution FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    solution = None if row[0] is None else np.load(io.BytesIO(row[0]), allow_pickle=False)
+                    self.remember(key, solution)
+                    self.hits += 1
+                    return True, solution
+
+            self.misses += 1
+            return False, None
+
+
+    def put(self, key: str, solution: typing.Optional[np.ndarray]):
+        """
+        Function that stores the result of the problem with the given key, in memory and (with a path) on disk.
+
+        :param key: The key of the problem, see problem_key
+        :param solution: The solution grid, or None if the problem has no solution
+        """
+
+        with self.lock:
+            if solution is not None:
+                solution = solution.copy()
+            self.remember(key, solution)
+
+            if self.connection is not None:
+                blob = None
+                if solution is not None:
+                    buffer = io.BytesIO()
+                    np.save(buffer, solution, allow_pickle=False)
+                    blob = buffer.getvalue()
+                self.connection.execute("INSERT OR REPLACE INTO results (key, solution) VALUES (?, ?)", (key, blob))
+                self.connection.commit()
+
+
+    def remember(self, key: str, solution: typing.Optional[np.ndarray]):
+        """
+        Function that puts a result in the in-memory LRU, evicting the least recently used results beyond maxsize.
+        """
+
+        self.results[key] = solution
+        self.results.move_to_end(key)
+        while len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+
+    def clear(self):
+        """
+        Function that removes all results, from memory and from disk.
+        """
+
+        with self.lock:
+            self.results.clear()
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM results")
+                self.connection.commit()
+
+
+    def close(self):
+        """
+        Function that closes the SQLite file (if any). The in-memory results stay usable.
+        """
+
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def cached_search(csp: CSP, cache: SolveCache, **search_settings) -> typing.Optional[np.ndarray]:
+    """
+    Cached version of CSP.start_search. If the problem of csp (see problem_key) was solved before, the stored result is
+    returned without searching and csp.nodes_expanded is 0. Otherwise the problem is solved and the result is stored,
+    unless the search was stopped by a node_limit or should_stop setting (csp.stopped).
+    Like start_search, the solution is written into csp.grid and returned, or None is returned if there is no solution.
+
+    :param csp: The problem to solve
+    :param cache: The cache to look the result up in and store it in
+    :param search_settings: The settings of CSP.prepare_search
+    """
+
+    key = problem_key(csp, **search_settings)
+    found, solution = cache.get(key)
+    if found:
+        csp.nodes_expanded = 0
+        if solution is None:
+            return None
+        csp.grid[...] = solution
+        return csp.grid
+
+    result = csp.start_search(**search_settings)
+    # a search that ran out of budget (see csp_budget) has not decided the problem
+    if not csp.stopped:
+        cache.put(key, result)
+    return result
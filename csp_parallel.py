@@ -0,0 +1,188 @@
+import multiprocessing
+import os
+import typing
+
+import numpy as np
+
+from csp import CSP
+
+
+# the problem every worker process solves subproblems of, set once per worker by _init_worker
+_worker_problem = None
+
+
+def _init_worker(grid: np.ndarray, numbers: typing.Set[int], groups: typing.List[typing.List[typing.Tuple[int,int]]],
+                 constraints: typing.List[typing.Tuple[int,int]], prefix_locations: typing.List[typing.Tuple[int,int]],
+                 search_settings: dict):
+    """
+    Pool initializer that stores the problem in the worker, so that a task only has to carry the values of its prefix.
+    """
+
+    global _worker_problem
+    _worker_problem = (grid, numbers, groups, constraints, prefix_locations, search_settings)
+
+
+def _solve_subproblem(prefix_values: typing.Tuple[int, ...]) -> typing.Tuple[typing.Optional[np.ndarray], int]:
+    """
+    Task that fills in the prefix values on a copy of the grid and searches the rest. Returns the solution (or None)
+    and the number of nodes expanded.
+    """
+
+    grid, numbers, groups, constraints, prefix_locations, search_settings = _worker_problem
+    grid = grid.copy()
+    for cell, value in zip(prefix_locations, prefix_values):
+        grid[cell] = value
+
+    csp = CSP(grid, numbers=numbers, groups=groups, constraints=constraints)
+    return csp.start_search(**search_settings), csp.nodes_expanded
+
+
+def split_problem(csp: CSP, split_depth: int) -> typing.Tuple[typing.List[typing.Tuple[int,int]], typing.Iterator[typing.Tuple[int, ...]]]:
+    """
+    Function that splits the search tree of csp by the values of its first split_depth empty locations (in the row by
+    row order of start_search). Returns these locations and a generator over the combinations of their values that do
+    not break any constraint on their own. Every solution of csp extends exactly one of these combinations.
+
+    :param csp: The problem to split, its grid is used as scratch space while the generator runs
+    :param split_depth: The number of empty locations to fix
+    """
+
+    empty_locations = csp.prepare_search()
+    if empty_locations is None:
+        return [], iter(())
+
+    prefix_cells = empty_locations[:split_depth]
+    prefix_locations = [divmod(cell, csp.width) for cell in prefix_cells.tolist()]
+
+    def prefixes():
+        for grid in csp.search_solutions(prefix_cells):
+            yield tuple(int(grid[cell]) for cell in prefix_locations)
+
+    return prefix_locations, prefixes()
+
+
+def choose_split_depth(csp: CSP, workers: int, tasks_per_worker: int = 8) -> int:
+    """
+    Function that returns the smallest split depth that gives at least tasks_per_worker subproblems per worker (or
+    all empty locations if there are not that many subproblems), so that the work stays balanced when some
+    subproblems are much harder than others.
+
+    :param csp: The problem to split
+    :param workers: The number of worker processes
+    :param tasks_per_worker: The number of subproblems wanted per worker
+    """
+
+    num_empty = int(np.count_nonzero(csp.grid == 0))
+    for split_depth in range(1, num_empty + 1):
+        prefix_locations, prefixes = split_problem(csp, split_depth)
+        num_prefixes = 0
+        for prefix in prefixes:
+            num_prefixes += 1
+            if num_prefixes >= workers * tasks_per_worker:
+                # stopping the generator early leaves values in the grid, clear them again
+                for cell in prefix_locations:
+                    csp.grid[cell] = 0
+                return split_depth
+
+    return num_empty
+
+
+def parallel_search(csp: CSP, workers: typing.Optional[int] = None, split_depth: typing.Optional[int] = None,
+                    **search_settings) -> typing.Optional[np.ndarray]:
+    """
+    Parallel version of CSP.start_search. The search tree is split by fixing the values of the first split_depth empty
+    locations (see split_problem) and the subproblems are solved by a pool of worker processes, every one on its own
+    copy of the grid. As soon as one worker finds a solution the pool is terminated, which stops the workers that are
+    still busy. Like start_search, the solution is written into csp.grid and returned, or None is returned if there is
+    no solution. csp.nodes_expanded is set to the total over the finished subproblems.
+
+    :param csp: The problem to solve
+    :param workers: The number of worker processes, defaults to the number of CPUs
+    :param split_depth: The number of empty locations to fix per subproblem, chosen by choose_split_depth if None
+    :param search_settings: The settings of CSP.prepare_search that the workers use
+    """
+
+    workers = workers or os.cpu_count() or 1
+    start_grid = csp.grid.copy()
+    if split_depth is None:
+        split_depth = choose_split_depth(csp, workers)
+
+    prefix_locations, prefixes = split_problem(csp, split_depth)
+    initargs = (start_grid, csp.numbers, csp.groups, csp.constraints, prefix_locations, search_settings)
+
+    solution = None
+    nodes_expanded = 0
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs)
+    try:
+        for result, nodes in pool.imap_unordered(_solve_subproblem, prefixes):
+            nodes_expanded += nodes
+            if result is not None:
+                solution = result
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    csp.nodes_expanded = nodes_expanded
+    if solution is None:
+        csp.grid[...] = start_grid
+        return None
+
+    csp.grid[...] = solution
+    return csp.grid
+
+
+def _solve_with_seed(seed: int) -> typing.Tuple[typing.Optional[np.ndarray], int, bool]:
+    """
+    Task that searches the whole problem with the given seed. Returns the solution (or None), the number of nodes
+    expanded and whether the search was stopped before it was complete.
+    """
+
+    grid, numbers, groups, constraints, prefix_locations, search_settings = _worker_problem
+    csp = CSP(grid.copy(), numbers=numbers, groups=groups, constraints=constraints)
+    return csp.start_search(seed=seed, **search_settings), csp.nodes_expanded, csp.stopped
+
+
+def portfolio_search(csp: CSP, seeds: typing.Optional[typing.List[int]] = None, workers: typing.Optional[int] = None,
+                     **search_settings) -> typing.Optional[np.ndarray]:
+    """
+    Portfolio version of CSP.start_search: every worker process searches the whole problem with its own seed (see the
+    seed and restarts settings of CSP.prepare_search), and the first worker that finishes decides. Runs with different
+    seeds take different random choices, so the time to solve is the minimum over the seeds, which cuts the long tail
+    of unlucky runs. Like start_search, the solution is written into csp.grid and returned, or None is returned if
+    there is no solution (or every run was stopped, see csp.stopped). csp.nodes_expanded is set to the total over the
+    finished runs.
+
+    :param csp: The problem to solve
+    :param seeds: The seeds to run, defaults to one per worker
+    :param workers: The number of worker processes, defaults to the number of seeds or else the number of CPUs
+    :param search_settings: The other settings of CSP.prepare_search, e.g. restarts="luby"
+    """
+
+    workers = workers or (len(seeds) if seeds else os.cpu_count() or 1)
+    seeds = seeds if seeds is not None else list(range(workers))
+    initargs = (csp.grid.copy(), csp.numbers, csp.groups, csp.constraints, [], search_settings)
+
+    solution = None
+    nodes_expanded = 0
+    stopped = True
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs)
+    try:
+        for result, nodes, run_stopped in pool.imap_unordered(_solve_with_seed, seeds):
+            nodes_expanded += nodes
+            # a solution, or a complete run that proves there is none
+            if result is not None or not run_stopped:
+                solution = result
+                stopped = False
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    csp.nodes_expanded = nodes_expanded
+    csp.stopped = stopped
+    if solution is None:
+        return None
+
+    csp.grid[...] = solution
+    return csp.grid
@@ -0,0 +1,113 @@
+import json
+import time
+import typing
+
+
+class SearchStats:
+    def __init__(self, on_assign: typing.Optional[typing.Callable[[typing.Tuple[int,int], int, int], None]] = None,
+                 on_backtrack: typing.Optional[typing.Callable[[typing.Tuple[int,int], int, int], None]] = None):
+        """
+        Opt-in statistics and tracing hooks for CSP searches. Pass an instance as the stats setting of
+        CSP.prepare_search / CSP.start_search; when no stats object is given the search does not pay for any of this.
+
+        :param on_assign: Called as on_assign(cell, value, depth) every time the search writes a value into a cell.
+        :param on_backtrack: Called as on_backtrack(cell, depth, target_depth) every time the values of the cell at
+                             depth run out and the search goes back to target_depth (-1 when the search is over).
+        """
+
+        self.on_assign = on_assign
+        self.on_backtrack = on_backtrack
+
+        self.phase_times = {}
+        self.phase_starts = {}
+        self.nodes_expanded = 0
+        self.backtracks = 0
+        self.max_depth = 0
+        self.group_checks = []
+        self.group_sum_failures = []
+        self.group_count_failures = []
+
+
+    def start_phase(self, phase: str):
+        """
+        Function that starts (or resumes) the wall clock of the given phase.
+
+        :param phase: The name of the phase, e.g. "fill_cell_to_groups" or "search"
+        """
+
+        self.phase_starts[phase] = time.perf_counter()
+
+
+    def end_phase(self, phase: str):
+        """
+        Function that stops the wall clock of the given phase and adds the elapsed time to self.phase_times[phase].
+
+        :param phase: The name of the phase
+        """
+
+        start = self.phase_starts.pop(phase, None)
+        if start is not None:
+            self.phase_times[phase] = self.phase_times.get(phase, 0.0) + time.perf_counter() - start
+
+
+    def record_assign(self, csp, cell: typing.Tuple[int,int], value: int, depth: int):
+        """
+        Function that the search calls right after writing value into cell. It counts the node, the depth and the
+        checks of the groups of cell (with separate counts of sum and count failures), and calls on_assign.
+        """
+
+        self.nodes_expanded += 1
+        if depth + 1 > self.max_depth:
+            self.max_depth = depth + 1
+
+        if len(self.group_checks) != csp.num_groups:
+            self.group_checks = [0] * csp.num_groups
+            self.group_sum_failures = [0] * csp.num_groups
+            self.group_count_failures = [0] * csp.num_groups
+
+        for group_idx in csp.groups_of_cell(cell):
+            self.group_checks[group_idx] += 1
+            if csp.sum_broken(group_idx):
+                self.group_sum_failures[group_idx] += 1
+            if csp.group_overfull[group_idx] != 0:
+                self.group_count_failures[group_idx] += 1
+
+        if self.on_assign is not None:
+            self.on_assign(cell, value, depth)
+
+
+    def record_backtrack(self, cell: typing.Tuple[int,int], depth: int, target_depth: int):
+        """
+        Function that the search calls when the values of the cell at depth run out, before it goes back to
+        target_depth. It counts the backtrack and calls on_backtrack.
+        """
+
+        self.backtracks += 1
+        if self.on_backtrack is not None:
+            self.on_backtrack(cell, depth, target_depth)
+
+
+    def as_dict(self) -> dict:
+        """
+        Function that returns the statistics as a dict of plain Python values.
+        """
+
+        return {
+            "nodes_expanded": self.nodes_expanded,
+            "backtracks": self.backtracks,
+            "max_depth": self.max_depth,
+            "phase_times": dict(self.phase_times),
+            "group_checks": list(self.group_checks),
+            "group_sum_failures": list(self.group_sum_failures),
+            "group_count_failures": list(self.group_count_failures),
+        }
+
+
+    def to_json(self, **json_kwargs) -> str:
+        """
+        Function that returns the statistics of as_dict as a JSON string, e.g. for a dashboard.
+
+        :param json_kwargs: Passed on to json.dumps (e.g. indent=2)
+        """
+
+        return json.dumps(self.as_dict(), **json_kwargs)
@@ -1,8 +1,20 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
 import typing
 import unittest
 import numpy as np
 
+from batch_solve import solve_batch
+from benchmark import FAMILIES, SETTINGS
 from csp import CSP
+from csp_budget import CancellationToken, async_budgeted_search, budgeted_search
+from csp_budget import CANCELLED, NO_SOLUTION, SOLVED, TIMED_OUT
+from csp_cache import SolveCache, cached_search, problem_key
+from csp_parallel import parallel_search, portfolio_search
+from csp_stats import SearchStats
 
 
 class TestCSP(unittest.TestCase):
@@ -63,4 +75,721 @@ class TestCSP(unittest.TestCase):
             
             self.assertTrue(np.all(solution_grid == result))
 
-            
\ No newline at end of file
+            
+    def test_incremental_group_state(self):
+            # the incremental group state must agree with the scanning predicates after every change
+
+            group_1 = [(0,0),(0,1),(0,2),(1,1)]
+            group_2 = [(1,0),(1,1),(1,2)]
+            group_3 = [(0,2),(1,2),(2,2),(2,0)]
+
+            groups = [group_1, group_2, group_3]
+            constraints = [(7, 1), (6, 2), (8, 2)]
+
+            rng = np.random.default_rng(0)
+            csp = CSP(np.zeros((3,3), dtype=int), numbers=set([1,2,3]), groups=groups, constraints=constraints)
+            csp.fill_cell_to_groups()
+            csp.init_group_state()
+
+            for step in range(500):
+                cell = (int(rng.integers(3)), int(rng.integers(3)))
+                csp.set_cell(cell, int(rng.integers(4)))
+                for group_idx in range(len(groups)):
+                    self.assertEqual(csp.satisfies_group_state([group_idx]),
+                                     csp.satisfies_group_constraints([group_idx]))
+
+            # a cell that a group lists twice counts twice, like in the scanning predicates
+            groups = [[(0,0),(0,0),(0,1)], [(0,1),(1,1),(0,1),(0,1)]]
+            constraints = [(5, 2), (9, 2)]
+            csp = CSP(np.zeros((2,2), dtype=int), numbers=set([1,2,3]), groups=groups, constraints=constraints)
+            csp.fill_cell_to_groups()
+            csp.init_group_state()
+
+            for step in range(500):
+                cell = (int(rng.integers(2)), int(rng.integers(2)))
+                csp.set_cell(cell, int(rng.integers(4)))
+                for group_idx in range(len(groups)):
+                    self.assertEqual(csp.satisfies_group_state([group_idx]),
+                                     csp.satisfies_group_constraints([group_idx]))
+
+            csp = CSP(np.array([[0,1]]), numbers=set([1,2]), groups=[[(0,0),(0,0),(0,1)]], constraints=[(5, 2)])
+            self.assertTrue(np.all(csp.start_search() == np.array([[2,1]])))
+
+    def test_forward_checking(self):
+            # forward checking finds the same solutions, also for numbers that are not 1..n
+
+            group_1 = [(0,0),(0,2),(1,1),(1,2)]
+            group_2 = [(0,1),(0,2),(1,2),(2,0)]
+            group_3 = [(1,0),(2,1),(2,2)]
+
+            groups = [group_1, group_2, group_3]
+            constraints = [(9, 2), (9, 2), (9, 2)]
+
+            valid_grid = np.array([[2,3,1],
+                                [0,2,0],
+                                [3,0,0]])
+
+            csp = CSP(valid_grid, numbers=set([1,2,3]), groups=groups, constraints=constraints)
+            result = csp.start_search(forward_checking=True)
+
+            solution_grid = np.array([[2,3,1],
+                                    [1,2,1],
+                                    [3,1,2]])
+
+            self.assertTrue(np.all(solution_grid == result))
+
+            rows = [[(row_idx, col_idx) for col_idx in range(3)] for row_idx in range(3)]
+            columns = [[(row_idx, col_idx) for row_idx in range(3)] for col_idx in range(3)]
+            groups = rows + columns
+            constraints = [(951, 1) for group in groups]
+
+            grid = np.array([[900,0,0],
+                             [0,0,0],
+                             [0,0,1]])
+
+            csp = CSP(grid, numbers=set([900,50,1]), groups=groups, constraints=constraints)
+            result = csp.start_search(forward_checking=True)
+
+            for group in groups:
+                self.assertEqual(sorted(result[cell] for cell in group), [1,50,900])
+
+    def test_forward_checking_no_solution(self):
+            # a clue that leaves no value for another cell is detected before searching
+
+            groups = [[(0,0),(0,1)], [(1,0), (1,1)], [(0,0), (1,0)], [(0,1), (1,1)]]
+            constraints = [(3, 1), (3, 1), (3, 1), (3, 1)]
+
+            grid = np.array([[1,0],
+                             [0,2]])
+            csp = CSP(grid, numbers=set([1,2]), groups=groups, constraints=constraints)
+            self.assertIsNone(csp.start_search(forward_checking=True))
+
+    def test_negative_numbers(self):
+            # with negative numbers a sum over the constraint can come down again, so it only fails a full group
+
+            groups = [[(0,0),(0,1)], [(0,0),(0,2)]]
+            constraints = [(0, 1), (100, 1)]
+            grid = np.array([[0,0,-5]])
+            solution_grid = np.array([[5,-5,-5]])
+
+            for search_settings in [{}, {"forward_checking": True}, {"variable_ordering": "mrv", "backjumping": True},
+                                    {"sum_bounds": True}, {"propagation": "search"}]:
+                csp = CSP(grid.copy(), numbers=set([5,-5]), groups=groups, constraints=constraints)
+                result = csp.start_search(**search_settings)
+                self.assertTrue(np.all(solution_grid == result))
+                self.assertTrue(csp.satisfies_group_constraints([0, 1]))
+
+            # a full group over its constraint still fails
+            csp = CSP(np.array([[0,5,5]]), numbers=set([5,-5]), groups=[[(0,0),(0,1),(0,2)]], constraints=[(-1, 3)])
+            self.assertIsNone(csp.start_search())
+
+    def test_search_orderings(self):
+            # every ordering solves a 4x4 sudoku, and mrv does not need more nodes than the row by row order
+
+            rows = [[(row_idx, col_idx) for col_idx in range(4)] for row_idx in range(4)]
+            columns = [[(row_idx, col_idx) for row_idx in range(4)] for col_idx in range(4)]
+            boxes = [[(box_row + i, box_col + j) for i in range(2) for j in range(2)] for box_row in (0, 2) for box_col in (0, 2)]
+            groups = rows + columns + boxes
+            constraints = [(10, 1) for group in groups]
+
+            grid = np.array([[0,0,0,4],
+                             [0,0,1,0],
+                             [0,3,0,0],
+                             [2,0,0,0]])
+
+            nodes = {}
+            for variable_ordering, value_ordering in [("static", "ascending"), ("degree", "ascending"),
+                                                      ("mrv", "ascending"), ("mrv", "lcv")]:
+                csp = CSP(grid.copy(), numbers=set([1,2,3,4]), groups=groups, constraints=constraints)
+                result = csp.start_search(forward_checking=True, variable_ordering=variable_ordering,
+                                          value_ordering=value_ordering)
+                self.assertIsNotNone(result)
+                self.assertTrue(np.all(result != 0))
+                self.assertTrue(csp.satisfies_group_constraints(list(range(len(groups)))))
+                nodes[variable_ordering, value_ordering] = csp.nodes_expanded
+
+            self.assertLessEqual(nodes["mrv", "ascending"], nodes["static", "ascending"])
+
+            with self.assertRaises(ValueError):
+                CSP(grid.copy(), numbers=set([1,2,3,4]), groups=groups, constraints=constraints).start_search(variable_ordering="random")
+
+    def test_search_many_empty_cells(self):
+            # more empty cells than the recursion limit allows stack frames
+
+            size = 40
+            groups = [[(row_idx, col_idx) for col_idx in range(size)] for row_idx in range(size)]
+            constraints = [(size * 3, size) for group in groups]
+
+            for forward_checking in [False, True]:
+                csp = CSP(np.zeros((size, size), dtype=int), numbers=set([3,7]), groups=groups, constraints=constraints)
+                result = csp.start_search(forward_checking=forward_checking)
+                self.assertTrue(np.all(result == 3))
+
+    def test_compile_groups(self):
+            # the precompiled arrays describe the same groups as self.groups
+
+            rng = np.random.default_rng(1)
+            height, width = 5, 7
+            all_cells = [(row_idx, col_idx) for row_idx in range(height) for col_idx in range(width)]
+            groups = [[all_cells[idx] for idx in rng.choice(len(all_cells), size=int(rng.integers(0, 8)), replace=False)]
+                      for group_idx in range(12)]
+            constraints = [(int(rng.integers(1, 20)), int(rng.integers(1, 3))) for group in groups]
+
+            csp = CSP(np.zeros((height, width), dtype=int), numbers=set([1,2,3]), groups=groups, constraints=constraints)
+            csp.fill_cell_to_groups()
+
+            for group_idx, group in enumerate(groups):
+                flat = csp.group_cells[csp.group_ptr[group_idx]:csp.group_ptr[group_idx + 1]]
+                self.assertEqual(flat.tolist(), [row_idx * width + col_idx for row_idx, col_idx in group])
+                self.assertEqual(csp.sum_constraints[group_idx], constraints[group_idx][0])
+                self.assertEqual(csp.count_constraints[group_idx], constraints[group_idx][1])
+
+            for row_idx, col_idx in all_cells:
+                expected = [group_idx for group_idx, group in enumerate(groups) if (row_idx, col_idx) in group]
+                self.assertEqual(csp.cell_to_groups[(row_idx, col_idx)], expected)
+                flat_idx = row_idx * width + col_idx
+                self.assertEqual(csp.cell_group_idx[csp.cell_group_ptr[flat_idx]:csp.cell_group_ptr[flat_idx + 1]].tolist(), expected)
+
+    def test_check_grids(self):
+            # the batch check gives the same answers as the predicates on every single grid
+
+            group_1 = [(0,0),(0,2),(1,1),(1,2)]
+            group_2 = [(0,1),(0,2),(1,2),(2,0)]
+            group_3 = [(1,0),(2,1),(2,2)]
+            group_4 = []
+
+            groups = [group_1, group_2, group_3, group_4]
+            constraints = [(7, 1), (8, 2), (6, 1), (0, 1)]
+
+            rng = np.random.default_rng(2)
+            grids = rng.choice([0, 1, 2, 3, 50], size=(200, 3, 3))
+
+            csp = CSP(np.zeros((3,3), dtype=int), numbers=set([1,2,3]), groups=groups, constraints=constraints)
+            sum_ok, count_ok = csp.check_grids(grids)
+            self.assertEqual(sum_ok.shape, (200, 4))
+            self.assertEqual(count_ok.shape, (200, 4))
+
+            for grid_idx in range(len(grids)):
+                single = CSP(grids[grid_idx], numbers=set([1,2,3]), groups=groups, constraints=constraints)
+                for group_idx in range(len(groups)):
+                    self.assertEqual(sum_ok[grid_idx, group_idx],
+                                     single.satisfies_sum_constraint(groups[group_idx], constraints[group_idx][0]))
+                    self.assertEqual(count_ok[grid_idx, group_idx],
+                                     single.satisfies_count_constraint(groups[group_idx], constraints[group_idx][1]))
+
+            # the same through the compact construction, which has not compiled its groups yet
+            group_cells = np.array([row_idx * 3 + col_idx for group in groups for row_idx, col_idx in group])
+            group_ptr = np.cumsum([0] + [len(group) for group in groups])
+            compact = CSP.from_arrays(np.zeros((3,3), dtype=int), set([1,2,3]), group_cells, group_ptr, constraints)
+            compact_sum_ok, compact_count_ok = compact.check_grids(grids)
+            self.assertTrue(np.all(compact_sum_ok == sum_ok))
+            self.assertTrue(np.all(compact_count_ok == count_ok))
+
+            with self.assertRaises(ValueError):
+                csp.check_grids(np.zeros((3,3), dtype=int))
+
+    def test_enumerate_solutions(self):
+            # all 576 4x4 latin squares are found, and counting stops at the limit
+
+            rows = [[(row_idx, col_idx) for col_idx in range(4)] for row_idx in range(4)]
+            columns = [[(row_idx, col_idx) for row_idx in range(4)] for col_idx in range(4)]
+            groups = rows + columns
+            constraints = [(10, 1) for group in groups]
+
+            csp = CSP(np.zeros((4,4), dtype=int), numbers=set([1,2,3,4]), groups=groups, constraints=constraints)
+            solutions = set()
+            for solution in csp.iter_solutions():
+                checker = CSP(solution, numbers=set([1,2,3,4]), groups=groups, constraints=constraints)
+                self.assertTrue(checker.satisfies_group_constraints(list(range(len(groups)))))
+                solutions.add(solution.tobytes())
+            self.assertEqual(len(solutions), 576)
+            self.assertTrue(np.all(csp.grid == 0))
+
+            self.assertEqual(csp.count_solutions(), 576)
+            self.assertEqual(csp.count_solutions(forward_checking=True, variable_ordering="mrv"), 576)
+            self.assertEqual(csp.count_solutions(limit=2), 2)
+            self.assertTrue(np.all(csp.grid == 0))
+
+            # a unique puzzle
+            grid = np.array([[1,2,3,4],
+                             [2,3,4,1],
+                             [3,4,1,2],
+                             [0,0,0,0]])
+            csp = CSP(grid, numbers=set([1,2,3,4]), groups=groups, constraints=constraints)
+            self.assertEqual(csp.count_solutions(limit=2), 1)
+
+            # with mixed signs a partial sum over the constraint can still come down, every solution is counted
+            csp = CSP(np.zeros((1,2), dtype=int), numbers=set([5,-5]), groups=[[(0,0),(0,1)]], constraints=[(0, 2)])
+            solutions = sorted(solution.tolist() for solution in csp.iter_solutions())
+            self.assertEqual(solutions, [[[-5,-5]], [[-5,5]], [[5,-5]]])
+            self.assertEqual(csp.count_solutions(), 3)
+            self.assertEqual(csp.count_solutions(forward_checking=True, variable_ordering="mrv"), 3)
+            self.assertEqual(csp.count_solutions(limit=2, exact_sums=True), 2)
+            self.assertEqual(csp.count_solutions(decompose=True, exact_sums=True), 2)
+
+    def test_parallel_search(self):
+            # the parallel search finds a valid solution and agrees with start_search when there is none
+
+            rows = [[(row_idx, col_idx) for col_idx in range(4)] for row_idx in range(4)]
+            columns = [[(row_idx, col_idx) for row_idx in range(4)] for col_idx in range(4)]
+            boxes = [[(box_row + i, box_col + j) for i in range(2) for j in range(2)] for box_row in (0, 2) for box_col in (0, 2)]
+            groups = rows + columns + boxes
+            constraints = [(10, 1) for group in groups]
+
+            grid = np.array([[0,0,0,4],
+                             [0,0,1,0],
+                             [0,3,0,0],
+                             [2,0,0,0]])
+            csp = CSP(grid.copy(), numbers=set([1,2,3,4]), groups=groups, constraints=constraints)
+            result = parallel_search(csp, workers=2, forward_checking=True)
+            self.assertIsNotNone(result)
+            self.assertTrue(np.all(result[grid != 0] == grid[grid != 0]))
+            self.assertTrue(np.all(result != 0))
+            self.assertTrue(csp.satisfies_group_constraints(list(range(len(groups)))))
+
+            grid[0, 0] = 4
+            csp = CSP(grid.copy(), numbers=set([1,2,3,4]), groups=groups, constraints=constraints)
+            self.assertIsNone(parallel_search(csp, workers=2, split_depth=3))
+            self.assertTrue(np.all(csp.grid == grid))
+
+    def test_backjumping(self):
+            # the first and the last empty cell can never both be filled in, the cells in between are free. Without
+            # backjumping every combination of the cells in between is tried, with it the search jumps straight back
+
+            width = 12
+            groups = [[(0,0), (0,width - 1)]]
+            constraints = [(2, 1)]
+
+            nodes = {}
+            for backjumping in [False, True]:
+                csp = CSP(np.zeros((1, width), dtype=int), numbers=set([1,2]), groups=groups, constraints=constraints)
+                self.assertIsNone(csp.start_search(backjumping=backjumping))
+                nodes[backjumping] = csp.nodes_expanded
+
+            self.assertGreater(nodes[False], 2 ** (width - 2))
+            self.assertLess(nodes[True], 4 * width)
+
+            # the answers do not change, also when the nogoods are reused
+            rows = [[(row_idx, col_idx) for col_idx in range(4)] for row_idx in range(4)]
+            columns = [[(row_idx, col_idx) for row_idx in range(4)] for col_idx in range(4)]
+            groups = rows + columns
+            constraints = [(10, 1) for group in groups]
+            for settings in [dict(backjumping=True), dict(forward_checking=True, backjumping=True),
+                             dict(variable_ordering="mrv", nogood_limit=10)]:
+                csp = CSP(np.zeros((4,4), dtype=int), numbers=set([1,2,3,4]), groups=groups, constraints=constraints)
+                self.assertEqual(csp.count_solutions(**settings), 576)
+
+    def test_search_stats(self):
+            # the stats agree with the search and the hooks see every assignment and backtrack
+
+            groups = [[(0,0),(0,1)], [(1,0), (1,1)], [(0,0), (1,0)], [(0,1), (1,1)]]
+            constraints = [(3, 1), (3, 1), (3, 1), (3, 1)]
+
+            assigned = []
+            backtracked = []
+            stats = SearchStats(on_assign=lambda cell, value, depth: assigned.append((cell, value, depth)),
+                                on_backtrack=lambda cell, depth, target_depth: backtracked.append((cell, depth)))
+
+            csp = CSP(np.array([[1,0],[0,0]]), numbers=set([1,2]), groups=groups, constraints=constraints)
+            self.assertIsNotNone(csp.start_search(stats=stats))
+
+            result = stats.as_dict()
+            self.assertEqual(result["nodes_expanded"], csp.nodes_expanded)
+            self.assertEqual(len(assigned), csp.nodes_expanded)
+            self.assertEqual(result["backtracks"], len(backtracked))
+            self.assertEqual(result["max_depth"], 3)
+            self.assertEqual(sum(result["group_checks"]), 2 * csp.nodes_expanded)
+            self.assertEqual(set(result["phase_times"]), {"fill_cell_to_groups", "setup", "search"})
+            self.assertEqual(json.loads(stats.to_json()), result)
+
+    def test_benchmark_families(self):
+            # the generated puzzles are solvable (except the unsatisfiable family) with every benchmark setting
+
+            for family, make_instance in FAMILIES.items():
+                instance = make_instance(2, seed=3) if family in ("sudoku", "killer") else make_instance(4, seed=3)
+                for settings in SETTINGS.values():
+                    csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+                    result = csp.start_search(**settings)
+                    if family == "unsat":
+                        self.assertIsNone(result)
+                    else:
+                        self.assertIsNotNone(result)
+                        self.assertTrue(csp.satisfies_group_constraints(list(range(len(instance.groups)))))
+
+            # a killer sudoku that needs the whole group as the reason of a pruned value when backjumping
+            instance = FAMILIES["killer"](3, seed=0)
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            self.assertIsNotNone(csp.start_search(variable_ordering="mrv", nogood_limit=1000))
+
+    def test_sum_bounds(self):
+            # sum bounds do not change the answer but cut the search, exact sums make the groups add up exactly
+
+            group_1 = [(0,0),(0,2),(1,1),(1,2)]
+            group_2 = [(0,1),(0,2),(1,2),(2,0)]
+            group_3 = [(1,0),(2,1),(2,2)]
+
+            groups = [group_1, group_2, group_3]
+            constraints = [(9, 2), (9, 2), (9, 2)]
+
+            valid_grid = np.array([[2,3,1],
+                                [0,2,0],
+                                [3,0,0]])
+
+            for settings in [dict(sum_bounds=True), dict(sum_bounds=True, forward_checking=True)]:
+                csp = CSP(valid_grid.copy(), numbers=set([1,2,3]), groups=groups, constraints=constraints)
+                result = csp.start_search(**settings)
+                solution_grid = np.array([[2,3,1],
+                                        [1,2,1],
+                                        [3,1,2]])
+                self.assertTrue(np.all(solution_grid == result))
+
+            for settings in [dict(exact_sums=True), dict(exact_sums=True, variable_ordering="mrv", backjumping=True)]:
+                csp = CSP(valid_grid.copy(), numbers=set([1,2,3]), groups=groups, constraints=constraints)
+                for solution in csp.iter_solutions(**settings):
+                    for group_idx, group in enumerate(groups):
+                        self.assertEqual(sum(solution[cell] for cell in group), constraints[group_idx][0])
+                self.assertEqual(csp.count_solutions(**settings), CSP(valid_grid.copy(), numbers=set([1,2,3]), groups=groups,
+                                                                      constraints=constraints).count_solutions(exact_sums=True))
+
+            instance = FAMILIES["killer"](3, seed=1)
+            nodes = {}
+            for sum_bounds in [False, True]:
+                csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+                self.assertIsNotNone(csp.start_search(forward_checking=True, exact_sums=sum_bounds))
+                nodes[sum_bounds] = csp.nodes_expanded
+            self.assertLess(nodes[True], nodes[False])
+
+    def test_from_arrays(self):
+            # the compact (array based) construction solves the same problem as the list based one
+
+            instance = FAMILIES["sudoku"](3, seed=2)
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            expected = csp.start_search(variable_ordering="mrv").copy()
+
+            group_cells = np.array([row_idx * 9 + col_idx for group in instance.groups for row_idx, col_idx in group])
+            group_ptr = np.cumsum([0] + [len(group) for group in instance.groups])
+            compact = CSP.from_arrays(instance.grid, instance.numbers, group_cells, group_ptr, instance.constraints)
+            self.assertEqual(compact.grid.dtype, np.uint8)
+            self.assertEqual(compact.group_cells.dtype, np.int32)
+            self.assertEqual(compact.groups, [list(group) for group in instance.groups])
+
+            result = compact.start_search(variable_ordering="mrv")
+            self.assertTrue(np.all(result == expected))
+            self.assertEqual(compact.cell_to_groups, csp.cell_to_groups)
+            self.assertEqual(compact.groups_of_cell((4,4)), [4, 13, 22])
+
+            # the sum of a group does not wrap around in the small dtype of the grid
+            compact = CSP.from_arrays(np.array([[200, 200, 200]]), set([100, 200]), np.array([0, 1, 2]), np.array([0, 3]),
+                                      [(100, 3)])
+            self.assertEqual(compact.grid.dtype, np.uint8)
+            self.assertFalse(compact.satisfies_sum_constraint(compact.groups[0], 100))
+            self.assertFalse(compact.satisfies_group_constraints([0]))
+
+    def test_solve_cache(self):
+            # repeated problems are answered from the cache, also "no solution" and also from disk
+
+            instance = FAMILIES["sudoku"](3, seed=0)
+            unsat = FAMILIES["unsat"](4, seed=0)
+            cache = SolveCache(maxsize=1)
+
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            expected = cached_search(csp, cache).copy()
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            self.assertTrue(np.all(cached_search(csp, cache) == expected))
+            self.assertEqual(csp.nodes_expanded, 0)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # the key does not depend on the dtype of the grid, but does depend on exact sums
+            compact = CSP(instance.grid.astype(np.uint8), instance.numbers, instance.groups, instance.constraints)
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            self.assertEqual(problem_key(compact), problem_key(csp))
+            self.assertNotEqual(problem_key(compact, exact_sums=True), problem_key(csp))
+
+            # nor on the order of the groups or of the cells in a group, but a constraint moved to another group counts
+            order = np.random.default_rng(0).permutation(len(instance.groups))
+            shuffled_groups = [list(reversed(instance.groups[group_idx])) for group_idx in order]
+            shuffled_constraints = [instance.constraints[group_idx] for group_idx in order]
+            shuffled = CSP(instance.grid.copy(), instance.numbers, shuffled_groups, shuffled_constraints)
+            self.assertEqual(problem_key(shuffled), problem_key(csp))
+            constraints = [list(instance.constraints), list(instance.constraints)]
+            constraints[0][0] = constraints[1][1] = (None, 2)
+            self.assertNotEqual(*[problem_key(CSP(instance.grid.copy(), instance.numbers, instance.groups, moved))
+                                  for moved in constraints])
+
+            # a search that runs out of budget is not stored as "no solution"
+            blank = FAMILIES["sudoku"](2, seed=0)
+            blank_grid = np.zeros((4, 4), dtype=np.int64)
+            cache = SolveCache()
+            csp = CSP(blank_grid.copy(), blank.numbers, blank.groups, blank.constraints)
+            self.assertIsNone(cached_search(csp, cache, node_limit=2))
+            self.assertTrue(csp.stopped)
+            csp = CSP(blank_grid.copy(), blank.numbers, blank.groups, blank.constraints)
+            self.assertIsNotNone(cached_search(csp, cache))
+            self.assertEqual(cache.misses, 2)
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "results.sqlite")
+                cache = SolveCache(maxsize=1, path=path)
+                self.assertIsNone(cached_search(CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints), cache))
+                cached_search(CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints), cache)
+                cache.close()
+
+                # a new cache (e.g. in another process) finds both results on disk
+                cache = SolveCache(maxsize=1, path=path)
+                csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+                self.assertIsNone(cached_search(csp, cache))
+                self.assertTrue(np.all(csp.grid == unsat.grid))
+                csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+                self.assertTrue(np.all(cached_search(csp, cache) == expected))
+                self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+                # a cache on disk can be used from other threads than the one that made it
+                results = []
+                def solve(problem):
+                    results.append(cached_search(CSP(problem.grid.copy(), problem.numbers, problem.groups,
+                                                     problem.constraints), cache))
+                threads = [threading.Thread(target=solve, args=(problem,)) for problem in [unsat, instance] * 4]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(results), 8)
+                self.assertEqual(sum(result is None for result in results), 4)
+                self.assertEqual((cache.hits, cache.misses), (10, 0))
+                cache.clear()
+                self.assertEqual(cache.get(problem_key(csp)), (False, None))
+                cache.close()
+
+    def test_decompose(self):
+            # independent parts are searched one after the other, free cells are filled in without search
+
+            horizontal_groups = [[(0,0),(0,1)], [(1,0), (1,1)]]
+            vertical_groups = [[(0,0), (1,0)], [(0,1), (1,1)]]
+            groups = horizontal_groups + vertical_groups
+            constraints = [(3, 1), (3, 1), (3, 1), (3, 1)]
+
+            valid_grid = np.array([[1,0,0],
+                                   [0,0,0]])
+            csp = CSP(valid_grid.copy(), numbers=set([1,2]), groups=groups, constraints=constraints)
+            result = csp.start_search(decompose=True)
+            solution_grid = np.array([[1,2,1],
+                                      [2,1,1]])
+            self.assertTrue(np.all(solution_grid == result))
+            self.assertEqual(CSP(valid_grid.copy(), numbers=set([1,2]), groups=groups,
+                                 constraints=constraints).count_solutions(decompose=True), 4)
+
+            # ten pairs that can be filled in two ways each, followed by three cells that cannot all differ
+            grid = np.zeros((1, 23), dtype=np.int64)
+            groups = [[(0, 2 * pair), (0, 2 * pair + 1)] for pair in range(10)] + [[(0, 20), (0, 21), (0, 22)]]
+            constraints = [(100, 1)] * len(groups)
+            nodes = {}
+            for decompose in [False, True]:
+                csp = CSP(grid.copy(), numbers=set([1,2]), groups=groups, constraints=constraints)
+                self.assertIsNone(csp.start_search(decompose=decompose))
+                self.assertTrue(np.all(csp.grid == 0))
+                nodes[decompose] = csp.nodes_expanded
+            self.assertLess(100 * nodes[True], nodes[False])
+
+            groups[-1] = groups[-1][:2]
+            csp = CSP(grid.copy(), numbers=set([1,2]), groups=groups, constraints=constraints)
+            self.assertEqual(csp.count_solutions(decompose=True), 2 ** 11 * 2)
+            self.assertEqual(csp.count_solutions(limit=100, decompose=True), 100)
+
+    def test_batch_solve(self):
+            # grid stacks and JSONL records are solved in input order, and an interrupted batch can be resumed
+
+            instances = [FAMILIES["sudoku"](2, seed=seed) for seed in range(6)]
+            instances.append(instances[0]._replace(grid=np.array([[1,1,0,0]] + [[0] * 4] * 3)))
+            groups = instances[0].groups
+            group_cells = np.array([row_idx * 4 + col_idx for group in groups for row_idx, col_idx in group])
+            group_ptr = np.cumsum([0] + [len(group) for group in groups])
+            grids = np.stack([instance.grid for instance in instances])
+
+            with tempfile.TemporaryDirectory() as directory:
+                np.save(os.path.join(directory, "grids.npy"), grids)
+                np.savez_compressed(os.path.join(directory, "grids.npz"), grids=grids, numbers=np.arange(1, 5),
+                                    group_cells=group_cells, group_ptr=group_ptr, constraints=np.array(instances[0].constraints))
+                with open(os.path.join(directory, "grids.jsonl"), "w") as records:
+                    for instance in instances:
+                        records.write(json.dumps({"grid": instance.grid.tolist(), "numbers": sorted(instance.numbers),
+                                                  "groups": groups, "constraints": instance.constraints}) + "\n")
+
+                problem = {"numbers": instances[0].numbers, "groups": groups, "constraints": instances[0].constraints}
+                for input_name in ["grids.npy", "grids.npz", "grids.jsonl"]:
+                    output_path = os.path.join(directory, input_name + ".out")
+                    # stop after 4 puzzles with a checkpoint after 3, then resume
+                    self.assertEqual(solve_batch(os.path.join(directory, input_name), output_path,
+                                                 problem if input_name == "grids.npy" else None, workers=2, window=2,
+                                                 limit=4, checkpoint_every=3), 4)
+                    with open(output_path + ".checkpoint") as checkpoint_file:
+                        self.assertEqual(json.load(checkpoint_file)["done"], 4)
+                    with open(output_path + ".checkpoint", "w") as checkpoint_file:
+                        json.dump({"done": 3, "offset": len("".join(open(output_path).readlines()[:3]))}, checkpoint_file)
+                    solve_batch(os.path.join(directory, input_name), output_path,
+                                problem if input_name == "grids.npy" else None, workers=2, resume=True,
+                                variable_ordering="mrv")
+
+                    with open(output_path) as output_file:
+                        results = [json.loads(line) for line in output_file]
+                    self.assertEqual([result["index"] for result in results], list(range(len(instances))))
+
+                    # without the output, resuming starts over instead of trusting the checkpoint
+                    os.remove(output_path)
+                    solve_batch(os.path.join(directory, input_name), output_path,
+                                problem if input_name == "grids.npy" else None, workers=2, resume=True)
+                    with open(output_path) as output_file:
+                        self.assertEqual([json.loads(line)["index"] for line in output_file], list(range(len(instances))))
+                    self.assertIsNone(results[-1]["solution"])
+                    for instance, result in zip(instances[:-1], results):
+                        solution = np.array(result["solution"])
+                        self.assertTrue(np.all(solution[instance.grid != 0] == instance.grid[instance.grid != 0]))
+                        csp = CSP(solution, instance.numbers, instance.groups, instance.constraints)
+                        self.assertTrue(csp.satisfies_group_constraints(list(range(len(groups)))))
+
+    def test_count_propagation(self):
+            # generalized arc consistency for the count constraints, before and during the search
+
+            # three cells that must differ: 1 and 2 are taken by the first two cells, so the third one gets 3
+            self.assertEqual(CSP.all_different_domains([0b011, 0b011, 0b111]), [0b011, 0b011, 0b100])
+            self.assertIsNone(CSP.all_different_domains([0b011, 0b011, 0b011]))
+
+            # a count constraint of 2 with one 1 filled in and one cell that can only be 1
+            csp = CSP(np.zeros((1, 3)), numbers=set([1,2,3]), groups=[], constraints=[])
+            csp.init_values()
+            self.assertEqual(csp.capped_domains([0b001, 0b011, 0b101], {1: 1}, 2), [0b001, 0b010, 0b100])
+            self.assertIsNone(csp.capped_domains([0b001, 0b001, 0b111], {1: 1}, 2))
+
+            # the pigeonhole is found before the search starts
+            instance = FAMILIES["unsat"](5, seed=0)
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            self.assertIsNone(csp.start_search(propagation="preprocess"))
+            self.assertEqual(csp.nodes_expanded, 0)
+
+            instance = FAMILIES["sudoku"](4, seed=0)
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            result = csp.start_search(variable_ordering="mrv", propagation="search")
+            self.assertTrue(np.all(result[instance.grid != 0] == instance.grid[instance.grid != 0]))
+            self.assertTrue(csp.satisfies_group_constraints(list(range(len(instance.groups)))))
+            self.assertLess(csp.nodes_expanded, 2 * np.count_nonzero(instance.grid == 0))
+
+            instance = FAMILIES["latin"](5, seed=3)
+            for propagation in ["preprocess", "search"]:
+                for settings in [{}, {"nogood_limit": 100}, {"exact_sums": True}]:
+                    csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+                    self.assertEqual(csp.count_solutions(propagation=propagation, **settings),
+                                     CSP(instance.grid.copy(), instance.numbers, instance.groups,
+                                         instance.constraints).count_solutions(**settings))
+
+    def test_budgeted_search(self):
+            # a search that runs out of budget or is cancelled is told apart from one without a solution
+
+            unsat = FAMILIES["unsat"](10, seed=0)
+            csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+            result = budgeted_search(csp, node_limit=500)
+            self.assertEqual((result.status, result.nodes_expanded), (TIMED_OUT, 500))
+            self.assertTrue(np.all(csp.grid == 0))
+
+            csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+            self.assertEqual(budgeted_search(csp, time_limit=0.05).status, TIMED_OUT)
+
+            small = FAMILIES["unsat"](3, seed=0)
+            csp = CSP(small.grid.copy(), small.numbers, small.groups, small.constraints)
+            self.assertEqual(budgeted_search(csp, time_limit=10, node_limit=10 ** 6).status, NO_SOLUTION)
+
+            instance = FAMILIES["sudoku"](2, seed=0)
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            result = budgeted_search(csp, time_limit=10, token=CancellationToken())
+            self.assertEqual(result.status, SOLVED)
+            self.assertIs(result.solution, csp.grid)
+
+            # cancelled from another thread
+            token = CancellationToken()
+            timer = threading.Timer(0.05, token.cancel)
+            timer.start()
+            csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+            self.assertEqual(budgeted_search(csp, token=token).status, CANCELLED)
+            timer.join()
+
+            # the event loop keeps running while the search runs, and cancelling the task stops the search
+            async def solve_and_cancel():
+                token = CancellationToken()
+                csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+                task = asyncio.ensure_future(async_budgeted_search(csp, token=token))
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                self.assertTrue(token.cancelled)
+                csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+                return await async_budgeted_search(csp, time_limit=10)
+
+            self.assertEqual(asyncio.run(solve_and_cancel()).status, SOLVED)
+
+    def test_restarts(self):
+            # seeded random choices and restarts on a schedule find the same answers, portfolios run seeds in parallel
+
+            self.assertEqual([CSP.luby(index) for index in range(1, 16)], [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8])
+
+            instance = FAMILIES["latin"](12, seed=27, clue_fraction=0.3)
+            grid = instance.grid
+            csp = CSP(grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            self.assertIsNone(csp.start_search(variable_ordering="mrv", node_limit=5000))
+            self.assertTrue(csp.stopped)
+
+            for settings in [{"restarts": "luby"}, {"restarts": "geometric", "seed": 4, "nogood_limit": 100}]:
+                csp = CSP(grid.copy(), instance.numbers, instance.groups, instance.constraints)
+                result = csp.start_search(variable_ordering="mrv", node_limit=20000, **settings)
+                self.assertIsNotNone(result)
+                self.assertTrue(np.all(result[grid != 0] == grid[grid != 0]))
+                self.assertTrue(csp.satisfies_group_constraints(list(range(len(instance.groups)))))
+
+            # the same seed takes the same choices
+            nodes = []
+            for repeat in range(2):
+                csp = CSP(grid.copy(), instance.numbers, instance.groups, instance.constraints)
+                csp.start_search(variable_ordering="mrv", value_ordering="lcv", seed=7, restarts="luby", restart_base=50)
+                nodes.append(csp.nodes_expanded)
+            self.assertEqual(nodes[0], nodes[1])
+
+            # restarts keep growing, so a problem without solution is still proven to have none
+            unsat = FAMILIES["unsat"](5, seed=0)
+            csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+            self.assertIsNone(csp.start_search(restarts="luby", restart_base=1))
+            self.assertFalse(csp.stopped)
+            self.assertTrue(np.all(csp.grid == 0))
+
+            csp = CSP(grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            result = portfolio_search(csp, seeds=[0, 1, 2], variable_ordering="mrv", restarts="luby")
+            self.assertIs(result, csp.grid)
+            self.assertTrue(csp.satisfies_group_constraints(list(range(len(instance.groups)))))
+            csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+            self.assertIsNone(portfolio_search(csp, seeds=[0, 1], restarts="luby"))
+            self.assertFalse(csp.stopped)
+
+    def test_search_after_fill_cell_to_groups(self):
+            # the search of the original assignment: fill_cell_to_groups, then search on the empty locations
+
+            instance = FAMILIES["sudoku"](3, seed=1)
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            expected = csp.start_search().copy()
+
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            csp.fill_cell_to_groups()
+            empty_locations = [(row_idx, col_idx) for row_idx in range(9) for col_idx in range(9)
+                               if instance.grid[row_idx, col_idx] == 0]
+            self.assertTrue(np.all(csp.search(empty_locations) == expected))
+
+            # after a search with other settings, fill_cell_to_groups makes search start from the current grid again
+            csp = CSP(instance.grid.copy(), instance.numbers, instance.groups, instance.constraints)
+            csp.start_search(variable_ordering="mrv")
+            csp.grid[...] = instance.grid
+            csp.fill_cell_to_groups()
+            result = csp.search(empty_locations)
+            self.assertTrue(np.all(result[instance.grid != 0] == instance.grid[instance.grid != 0]))
+            self.assertTrue(np.all(result != 0))
+            self.assertTrue(csp.satisfies_group_constraints(list(range(len(instance.groups)))))
+
+            unsat = FAMILIES["unsat"](3, seed=0)
+            csp = CSP(unsat.grid.copy(), unsat.numbers, unsat.groups, unsat.constraints)
+            csp.fill_cell_to_groups()
+            self.assertIsNone(csp.search([(row_idx, col_idx) for row_idx in range(3) for col_idx in range(3)]))